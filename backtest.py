@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import warnings
+
+import numpy as np
+
+from data_cleaning import clean_dataset
+from data_loading import read_dataset
+from sarimax_core import (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER, EXOGENOUS_VARS, collect_series,
+                          default_workers, fit_sarimax, make_executor)
+
+# Rolling-origin backtesting: each fold fits the SARIMAX model on the observations before
+# a forecast origin and forecasts the next `horizon` observations, which are then compared
+# with the actual values. Adjacent folds of a series run in the same worker and start the
+# optimizer from the previous fold's parameters.
+#
+#   python backtest.py data/smdatasets.csv --horizon 2 --folds 6 --output backtest.json
+
+DEFAULT_HORIZON = 2  # observations, i.e. one Dry and one Wet season
+DEFAULT_FOLDS = 5
+DEFAULT_STEP = 1
+
+# Folds with fewer training observations than this are skipped
+MIN_TRAIN_SIZE = 12
+
+# Series are only split into parallel chains of at least this many folds, so that most
+# folds are still warm-started from their predecessor
+MIN_FOLDS_PER_CHAIN = 3
+
+
+def make_folds(n_obs, horizon=DEFAULT_HORIZON, n_folds=DEFAULT_FOLDS, step=DEFAULT_STEP, window=None):
+    # (train_start, origin) pairs, oldest first. The last origin leaves exactly `horizon`
+    # observations for testing and earlier origins move back by `step`. Windows expand
+    # from the first observation, or roll with a fixed length when `window` is given.
+    folds = []
+    for i in reversed(range(n_folds)):
+        origin = n_obs - horizon - i * step
+        train_start = max(origin - window, 0) if window else 0
+        if origin - train_start >= MIN_TRAIN_SIZE:
+            folds.append((train_start, origin))
+    return folds
+
+
+def _run_folds(production, exog_data, order, seasonal_order, folds, horizon, alpha):
+    # Worker entry point: fit and forecast a chain of adjacent folds, warm-starting each
+    # fit from the parameters of the previous one. The exogenous variables keep their last
+    # training values over the test period, as in sarimax_core.forecast_sarimax.
+    start_params = None
+    outcomes = []
+    for train_start, origin in folds:
+        outcome = {'origin': origin, 'train_size': origin - train_start, 'warm': start_params is not None}
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                results = fit_sarimax(production[train_start:origin], exog_data[train_start:origin],
+                                      order, seasonal_order, start_params)
+                prediction = results.get_forecast(horizon, exog=np.tile(exog_data[origin - 1], (horizon, 1)))
+        except (ValueError, np.linalg.LinAlgError) as e:
+            outcomes.append(dict(outcome, error=str(e)))
+            start_params = None
+            continue
+        forecast = np.asarray(prediction.predicted_mean)
+        intervals = np.asarray(prediction.conf_int(alpha=alpha))
+        outcomes.append(dict(
+            outcome, error=None,
+            actual=_json_values(production[origin:origin + horizon]), forecast=_json_values(forecast),
+            lower=_json_values(intervals[:, 0]), upper=_json_values(intervals[:, 1]),
+            iterations=results.mle_retvals.get('iterations'),
+            converged=bool(results.mle_retvals.get('converged')),
+        ))
+        # A degenerate fit (e.g. undefined prediction intervals) would trap the next fold
+        # in the same point, so the next fold starts cold instead
+        degenerate = not (np.isfinite(results.llf) and np.isfinite(forecast).all() and np.isfinite(intervals).all())
+        start_params = None if degenerate else results.params
+    return outcomes
+
+
+def _json_values(values):
+    # Floats for the JSON report; undefined values become null
+    return [float(value) if np.isfinite(value) else None for value in values]
+
+
+def _accuracy(actual, forecast, lower, upper):
+    # Point metrics skip undefined forecasts; undefined intervals do not cover the actual value
+    errors = actual - forecast
+    defined = np.isfinite(errors)
+    relative = defined & (actual != 0)
+    return {
+        'mape': float(np.mean(np.abs(errors[relative] / actual[relative])) * 100) if relative.any() else None,
+        'rmse': float(np.sqrt(np.mean(errors[defined] ** 2))) if defined.any() else None,
+        'coverage': float(np.mean((actual >= lower) & (actual <= upper))) if len(actual) else None,
+    }
+
+
+def fold_metrics(folds, horizon):
+    # MAPE (%), RMSE and prediction interval coverage over all successful folds of a series,
+    # overall and per forecast step
+    completed = [fold for fold in folds if fold['error'] is None]
+    values = {key: np.array([fold[key] for fold in completed], dtype=float).reshape(len(completed), horizon)
+              for key in ('actual', 'forecast', 'lower', 'upper')}
+    metrics = _accuracy(*(values[key].ravel() for key in ('actual', 'forecast', 'lower', 'upper')))
+    metrics['by_step'] = [dict(step=step + 1, **_accuracy(*(values[key][:, step]
+                                                            for key in ('actual', 'forecast', 'lower', 'upper'))))
+                          for step in range(horizon)]
+    metrics['folds'] = len(completed)
+    metrics['failed'] = len(folds) - len(completed)
+    iterations = [fold['iterations'] for fold in completed if fold['iterations'] is not None]
+    metrics['mean_iterations'] = float(np.mean(iterations)) if iterations else None
+    return metrics
+
+
+def backtest_series(series, horizon=DEFAULT_HORIZON, n_folds=DEFAULT_FOLDS, step=DEFAULT_STEP, window=None,
+                    order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER, orders=None, alpha=0.05,
+                    max_workers=None):
+    # Backtest every (name, production, exog_data) in `series`. The folds of each series are
+    # split into contiguous chains of at least MIN_FOLDS_PER_CHAIN folds, just enough to keep
+    # all workers busy; chains run in parallel and folds within a chain are warm-started. `orders` optionally maps names to
+    # their own (order, seasonal_order). Returns {name: {'folds': [...], 'metrics': {...}}}.
+    if max_workers is None:
+        max_workers = default_workers()
+    fold_plans = {name: make_folds(len(production), horizon, n_folds, step, window)
+                  for name, production, _ in series}
+    chains_per_series = max(1, -(-max_workers // max(len(series), 1)))
+
+    tasks = []
+    for name, production, exog_data in series:
+        folds = fold_plans[name]
+        spec = (orders or {}).get(name, (order, seasonal_order))
+        n_chains = max(1, min(chains_per_series, len(folds) // MIN_FOLDS_PER_CHAIN))
+        for chain in np.array_split(np.arange(len(folds)), n_chains):
+            if len(chain):
+                tasks.append((name, (production, exog_data, spec[0], spec[1],
+                                     [folds[i] for i in chain], horizon, alpha)))
+
+    outcomes = {name: [] for name, _, _ in series}
+    executor = make_executor(max_workers, len(tasks))
+    if executor is None:
+        for name, args in tasks:
+            outcomes[name].extend(_run_folds(*args))
+    else:
+        with executor:
+            futures = [(name, args, executor.submit(_run_folds, *args)) for name, args in tasks]
+            for name, args, future in futures:
+                try:
+                    outcomes[name].extend(future.result())
+                except Exception as e:
+                    # e.g. a worker process died; only the folds of this chain are reported as failed
+                    outcomes[name].extend({'origin': origin, 'train_size': origin - train_start, 'warm': False,
+                                           'error': str(e)} for train_start, origin in args[4])
+
+    return {name: {'folds': folds, 'metrics': fold_metrics(folds, horizon)} for name, folds in outcomes.items()}
+
+
+def backtest_report(results, **settings):
+    # Machine-readable report of backtest_series results
+    return {
+        'settings': settings,
+        'series': [{'name': str(name), 'metrics': result['metrics'], 'folds': result['folds']}
+                   for name, result in results.items()],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the SARIMAX forecasts.")
+    parser.add_argument("csv", nargs="+", help="Input CSV file(s) in the dashboard's dataset format.")
+    parser.add_argument("--horizon", type=int, default=DEFAULT_HORIZON,
+                        help=f"Observations forecast per fold (default: {DEFAULT_HORIZON}).")
+    parser.add_argument("--folds", type=int, default=DEFAULT_FOLDS, help=f"Folds per series (default: {DEFAULT_FOLDS}).")
+    parser.add_argument("--step", type=int, default=DEFAULT_STEP,
+                        help=f"Observations between forecast origins (default: {DEFAULT_STEP}).")
+    parser.add_argument("--window", type=int, help="Rolling training window length (default: expanding window).")
+    parser.add_argument("--municipalities", nargs="+", help="Only backtest these municipalities.")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Number of processes (default: CPU count, 1 runs serially).")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Prediction interval level (default: 0.05).")
+    parser.add_argument("--output", default="backtest.json", help="JSON report file (default: backtest.json).")
+    args = parser.parse_args(argv)
+
+    series = []
+    for path in args.csv:
+        try:
+            cleaned, municipalities = clean_dataset(read_dataset(path), municipalities=args.municipalities)
+        except ValueError as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        columns = [var for var in EXOGENOUS_VARS if var in cleaned.columns]
+        for municipality, (_, production, exog_data, _) in collect_series(cleaned, municipalities, columns).items():
+            series.append((f"{os.path.basename(path)}:{municipality}", production, exog_data))
+
+    results = backtest_series(series, args.horizon, args.folds, args.step, args.window,
+                              alpha=args.alpha, max_workers=args.workers)
+    report = backtest_report(results, horizon=args.horizon, folds=args.folds, step=args.step, window=args.window,
+                             alpha=args.alpha, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    for entry in report['series']:
+        metrics = entry['metrics']
+        print(f"{entry['name']}: {metrics['folds']} folds ({metrics['failed']} failed), "
+              f"MAPE {metrics['mape'] if metrics['mape'] is not None else float('nan'):.2f}%, "
+              f"RMSE {metrics['rmse'] if metrics['rmse'] is not None else float('nan'):.2f}, "
+              f"coverage {metrics['coverage'] if metrics['coverage'] is not None else float('nan'):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,554 @@
+import warnings
+
+import numpy as np
+from scipy.stats import norm
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from sarimax_core import DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER, build_model
+
+# Vectorized SARIMAX engine for many short series of the same specification.
+#
+# The model is the regression with SARIMA errors used by statsmodels' SARIMAX:
+# y_t = x_t beta + u_t, with u_t following SARIMA(p,d,q)(P,D,Q,s). The series and the
+# exogenous variables are differenced up front (like SARIMAX(simple_differencing=True)),
+# and the remaining ARMA part is written in the same state space form as statsmodels.
+# All series are stacked into (n_series, ...) arrays, right-aligned in time with the
+# missing leading observations masked out, so that each Kalman filter step runs once
+# for the whole batch instead of once per series. The parameters of all series are
+# estimated together with a batched BFGS whose gradients and line searches are also
+# single filter passes over a widened batch.
+
+LOG_2PI = np.log(2 * np.pi)
+
+# Iterations of the doubling algorithm for the stationary state covariance; covers
+# 2^40 lags, enough for roots arbitrarily close to the unit circle in double precision
+LYAPUNOV_MAX_DOUBLINGS = 40
+
+# batch_forecast only estimates series with at least this many differenced observations per parameter
+MIN_OBSERVATIONS_PER_PARAM = 2
+
+# Step sizes tried by the batched backtracking line search
+LINE_SEARCH_STEPS = 0.5 ** np.arange(10)
+
+# Singular values of the differenced, unit-norm exogenous columns below this count as
+# zero: such columns (e.g. Total area = certified + hybrid area up to the rounding of the
+# CSV, or Season codes that seasonal differencing removes) have no identified coefficient
+# under the differenced likelihood and are left out of the batched fit
+COLLINEARITY_TOLERANCE = 1e-6
+
+# Relative differences that agreement_failures accepts. At statsmodels' estimates the
+# engines agree to rounding error (typically 1e-10 to 1e-7). The dashboard's SARIMAX
+# maximizes a different likelihood (diffuse, with the differencing in the state space),
+# so its forecasts only agree with the batched engine's to a few percent.
+AGREEMENT_TOLERANCES = {
+    'llf_diff_at_statsmodels_params': 1e-5,
+    'mean_diff_at_statsmodels_params': 1e-5,
+    'variance_diff_at_statsmodels_params': 1e-5,
+    'forecast_diff_dashboard': 0.1,
+}
+
+
+def difference(values, d, D, s):
+    # Apply (1 - L)^d (1 - L^s)^D along the time axis (axis 1)
+    for _ in range(d):
+        values = values[:, 1:] - values[:, :-1]
+    for _ in range(D):
+        values = values[:, s:] - values[:, :-s]
+    return values
+
+
+def integration_coefficients(d, D, s):
+    # Coefficients c_i with (1 - L)^d (1 - L^s)^D = 1 - sum_i c_i L^i
+    polynomial = np.array([1.0])
+    for _ in range(d):
+        polynomial = np.convolve(polynomial, [1.0, -1.0])
+    for _ in range(D):
+        polynomial = np.convolve(polynomial, np.r_[1.0, np.zeros(s - 1), -1.0])
+    return -polynomial[1:]
+
+
+def constrain_stationary(unconstrained):
+    # Batched version of statsmodels' constrain_stationary_univariate (Monahan, 1984)
+    n = unconstrained.shape[1]
+    r = unconstrained / np.sqrt(1 + unconstrained ** 2)
+    y = np.zeros(unconstrained.shape + (n,))
+    for k in range(n):
+        for i in range(k):
+            y[:, k, i] = y[:, k - 1, i] + r[:, k] * y[:, k - 1, k - i - 1]
+        y[:, k, k] = r[:, k]
+    return -y[:, n - 1, :] if n else unconstrained.copy()
+
+
+def _lag_polynomial(coefficients, sign, step):
+    # Batched 1 + sign * sum_j coefficients_j L^(j * step), as (n_series, degree + 1)
+    n_series, n_coefficients = coefficients.shape
+    if not n_coefficients:
+        return np.ones((n_series, 1))
+    polynomial = np.zeros((n_series, n_coefficients * step + 1))
+    polynomial[:, 0] = 1
+    polynomial[:, step::step] = sign * coefficients
+    return polynomial
+
+
+def _multiply_polynomials(first, second):
+    product = np.zeros((first.shape[0], first.shape[1] + second.shape[1] - 1))
+    for i in range(first.shape[1]):
+        product[:, i:i + second.shape[1]] += first[:, i:i + 1] * second
+    return product
+
+
+def identified_columns(exogs, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER):
+    # Indices of the exogenous columns that stay linearly independent after differencing,
+    # over all series of a batch; the first of a set of dependent columns is kept
+    _, d, _ = order
+    _, D, _, s = seasonal_order
+    differenced = np.vstack([difference(np.asarray(exog, dtype=float)[None], d, D, s)[0] for exog in exogs])
+    norms = np.linalg.norm(differenced, axis=0)
+    columns = []
+    for j in np.flatnonzero(norms > 0):
+        candidate = differenced[:, columns + [j]] / norms[columns + [j]]
+        if np.linalg.matrix_rank(candidate, tol=COLLINEARITY_TOLERANCE) > len(columns):
+            columns.append(j)
+    return columns
+
+
+class BatchSARIMAX:
+
+    def __init__(self, endogs, exogs, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER):
+        self.order = tuple(order)
+        self.seasonal_order = tuple(seasonal_order)
+        p, d, q = self.order
+        P, D, Q, s = self.seasonal_order
+        self.k_exog = 0 if exogs is None else np.asarray(exogs[0]).reshape(len(endogs[0]), -1).shape[1]
+        self.k_params = self.k_exog + p + q + P + Q + 1
+        self.n_series = len(endogs)
+
+        # Right-align all series (levels) in NaN-padded arrays
+        n_periods = max(len(endog) for endog in endogs)
+        self.endog = np.full((self.n_series, n_periods), np.nan)
+        self.exog = np.full((self.n_series, n_periods, self.k_exog), np.nan)
+        for i, endog in enumerate(endogs):
+            self.endog[i, n_periods - len(endog):] = endog
+            if self.k_exog:
+                self.exog[i, n_periods - len(endog):] = np.asarray(exogs[i], dtype=float).reshape(len(endog), -1)
+
+        # Differenced data used by the filter; padded positions are masked out
+        self._w = difference(self.endog, d, D, s)
+        self._z = difference(self.exog, d, D, s)
+        self._mask = ~np.isnan(self._w) & ~np.isnan(self._z).any(axis=2)
+        self._w = np.where(self._mask, self._w, 0.0)
+        self._z = np.where(self._mask[:, :, None], self._z, 0.0)
+        self.nobs_effective = self._mask.sum(axis=1)
+
+        # The optimizer works on standardized parameters, so that regression coefficients and
+        # variances of very different magnitudes are equally well conditioned
+        self._y_scale = self._scale(self._w, self._mask)
+        self._x_scale = np.stack([self._scale(self._z[:, :, j], self._mask) for j in range(self.k_exog)], axis=1) \
+            if self.k_exog else np.ones((self.n_series, 0))
+
+        # Dimension of the ARMA state vector
+        self._k_ar = p + P * s
+        self._k_ma = q + Q * s
+        self.k_states = max(self._k_ar, self._k_ma + 1)
+
+        self.params = None
+        self.unconstrained_params = None
+        self.llf = None
+        self.converged = None
+        self.iterations = 0
+
+    @staticmethod
+    def _scale(values, mask):
+        count = np.maximum(mask.sum(axis=1), 1)
+        mean = values.sum(axis=1) / count
+        std = np.sqrt((mask * (values - mean[:, None]) ** 2).sum(axis=1) / count)
+        return np.where(std > 0, std, 1.0)
+
+    # Parameters ---------------------------------------------------------------------
+
+    def transform_params(self, unconstrained):
+        # Same transformations as SARIMAX.transform_params, for (n, k_params) arrays
+        p, _, q = self.order
+        P, _, Q, _ = self.seasonal_order
+        constrained = np.array(unconstrained, dtype=float, copy=True)
+        start = self.k_exog
+        for size, sign in ((p, 1), (q, -1), (P, 1), (Q, -1)):
+            constrained[:, start:start + size] = sign * constrain_stationary(unconstrained[:, start:start + size])
+            start += size
+        constrained[:, -1] = unconstrained[:, -1] ** 2
+        return constrained
+
+    def _to_params(self, unconstrained, rows):
+        # Constrained parameters on the scale of the data from standardized unconstrained ones
+        params = self.transform_params(unconstrained)
+        params[:, :self.k_exog] *= self._y_scale[rows, None] / self._x_scale[rows]
+        params[:, -1] *= self._y_scale[rows] ** 2
+        return params
+
+    def start_params(self):
+        # Standardized unconstrained starting values: OLS of the differenced series on the
+        # differenced exog, without ARMA terms
+        unconstrained = np.zeros((self.n_series, self.k_params))
+        for i in range(self.n_series):
+            mask = self._mask[i]
+            w = self._w[i, mask] / self._y_scale[i]
+            z = self._z[i, mask] / self._x_scale[i]
+            residuals = w
+            if self.k_exog and len(w):
+                beta = np.linalg.lstsq(z, w, rcond=None)[0]
+                unconstrained[i, :self.k_exog] = beta
+                residuals = w - z @ beta
+            unconstrained[i, -1] = np.sqrt(max(np.var(residuals), 1e-8)) if len(w) else 1.0
+        return unconstrained
+
+    # State space representation -------------------------------------------------------
+
+    def _state_space(self, params):
+        # Transition matrix, selection vector and initial state covariance for each series
+        p, _, q = self.order
+        P, _, Q, s = self.seasonal_order
+        n = params.shape[0]
+        start = self.k_exog
+        ar, ma = params[:, start:start + p], params[:, start + p:start + p + q]
+        seasonal_ar = params[:, start + p + q:start + p + q + P]
+        seasonal_ma = params[:, start + p + q + P:start + p + q + P + Q]
+        sigma2 = params[:, -1]
+
+        phi = -_multiply_polynomials(_lag_polynomial(ar, -1, 1), _lag_polynomial(seasonal_ar, -1, s))[:, 1:]
+        theta = _multiply_polynomials(_lag_polynomial(ma, 1, 1), _lag_polynomial(seasonal_ma, 1, s))[:, 1:]
+
+        m = self.k_states
+        transition = np.zeros((n, m, m))
+        transition[:, :phi.shape[1], 0] = phi
+        transition[:, np.arange(m - 1), np.arange(1, m)] = 1
+        selection = np.zeros((n, m))
+        selection[:, 0] = 1
+        selection[:, 1:theta.shape[1] + 1] = theta
+        state_cov = sigma2[:, None, None] * selection[:, :, None] * selection[:, None, :]
+
+        # Stationary initialization: P = T P T' + R R' sigma2, solved for all series at once by
+        # the doubling algorithm, P = sum_k T^k R R' sigma2 T'^k, which doubles the number of
+        # summed terms per iteration
+        initial_cov = state_cov.copy()
+        power = transition.copy()
+        for _ in range(LYAPUNOV_MAX_DOUBLINGS):
+            initial_cov = initial_cov + power @ initial_cov @ power.transpose(0, 2, 1)
+            power = power @ power
+            if np.abs(power).max() < 1e-12:
+                break
+        return transition, state_cov, initial_cov
+
+    def _filter(self, params, rows=None):
+        # Kalman filter over all periods. Returns the loglikelihood of each series and the
+        # one-step-ahead predicted state mean and covariance after the last period.
+        rows = np.arange(self.n_series) if rows is None else rows
+        mask = self._mask[rows].T.astype(float)
+        transition, state_cov, cov = self._state_space(params)
+        residuals = (self._w[rows] - np.einsum('ntk,nk->nt', self._z[rows], params[:, :self.k_exog])).T
+
+        # The loop works on series-last arrays, so every step runs on contiguous rows. The
+        # transition matrix is a companion matrix (first column phi, ones above the diagonal),
+        # so T a and T P T' reduce to shifted copies plus a rank-one term.
+        phi = np.ascontiguousarray(transition[:, :, 0].T)
+        state_cov = np.ascontiguousarray(state_cov.transpose(1, 2, 0))
+        cov = np.ascontiguousarray(cov.transpose(1, 2, 0))
+        state = np.zeros((self.k_states, params.shape[0]))
+        loglike = np.zeros(params.shape[0])
+        for t in range(residuals.shape[0]):
+            observed = mask[t]
+            forecast_error = residuals[t] - state[0]
+            forecast_var = np.maximum(cov[0, 0], 1e-300)
+            loglike -= 0.5 * observed * (LOG_2PI + np.log(forecast_var) + forecast_error ** 2 / forecast_var)
+
+            # Missing (padded) periods have zero gain: prediction without an update
+            gain = cov[:, 0] * (observed / forecast_var)
+            state = state + gain * forecast_error
+            cov = cov - forecast_var * gain[:, None] * gain[None, :]
+
+            predicted_state = phi * state[0]
+            predicted_state[:-1] += state[1:]
+            state = predicted_state
+            partial = phi[:, None] * cov[None, 0]
+            partial[:-1] += cov[1:]
+            cov = partial[:, :1] * phi[None] + state_cov
+            cov[:, :-1] += partial[:, 1:]
+        return loglike, state.T, cov.transpose(2, 0, 1)
+
+    def loglike(self, params, rows=None):
+        # Loglikelihood of each series at the given (constrained) parameters
+        return self._filter(np.atleast_2d(params), rows)[0]
+
+    # Estimation -------------------------------------------------------------------------
+
+    def _objective(self, unconstrained, rows):
+        # Negative average loglikelihood per observation, as minimized by statsmodels
+        loglike = self.loglike(self._to_params(unconstrained, rows), rows)
+        value = -loglike / np.maximum(self.nobs_effective[rows], 1)
+        return np.where(np.isfinite(value), value, np.inf)
+
+    def _gradient(self, unconstrained, rows):
+        # Central differences for every parameter of every series in one widened filter pass
+        n, k = unconstrained.shape
+        step = 1e-5 * np.maximum(np.abs(unconstrained), 1.0)
+        shifts = np.zeros((2 * k, n, k))
+        for j in range(k):
+            shifts[2 * j, :, j] = step[:, j]
+            shifts[2 * j + 1, :, j] = -step[:, j]
+        values = self._objective((unconstrained[None] + shifts).reshape(2 * k * n, k),
+                                 np.tile(rows, 2 * k)).reshape(2 * k, n)
+        return ((values[0::2] - values[1::2]) / (2 * step.T)).T
+
+    def fit(self, start_params=None, maxiter=200, gtol=1e-5, ftol=1e-10):
+        # Batched BFGS in the standardized unconstrained parameter space. `start_params` are
+        # such (n_series, k_params) values, e.g. the unconstrained_params of an earlier fit of
+        # similar data; by default OLS estimates without ARMA terms.
+        x = self.start_params() if start_params is None else np.array(start_params, dtype=float)
+        rows = np.arange(self.n_series)
+        value = self._objective(x, rows)
+        gradient = self._gradient(x, rows)
+        inverse_hessian = np.tile(np.eye(self.k_params), (self.n_series, 1, 1))
+        active = np.isfinite(value)
+        converged = np.zeros(self.n_series, dtype=bool)
+        first_step = np.ones(self.n_series, dtype=bool)
+
+        for iteration in range(maxiter):
+            converged |= active & (np.abs(gradient).max(axis=1) < gtol)
+            active &= ~converged
+            if not active.any():
+                break
+            idx = np.flatnonzero(active)
+
+            direction = -np.einsum('nij,nj->ni', inverse_hessian[idx], gradient[idx])
+            slope = np.einsum('ni,ni->n', gradient[idx], direction)
+            # Fall back to steepest descent where the BFGS direction is not a descent direction
+            uphill = slope >= 0
+            direction[uphill] = -gradient[idx][uphill]
+            slope[uphill] = -np.einsum('ni,ni->n', gradient[idx][uphill], gradient[idx][uphill])
+
+            # Backtracking line search. The full step is tried first; for the series that
+            # reject it, all shorter step sizes are evaluated together in one filter pass.
+            n_steps = len(LINE_SEARCH_STEPS)
+            candidate_values = np.full((n_steps, len(idx)), np.inf)
+            candidate_values[0] = self._objective(x[idx] + direction, idx)
+            sufficient = value[idx][None] + 1e-4 * LINE_SEARCH_STEPS[:, None] * slope[None]
+            retry = np.flatnonzero(~(candidate_values[0] <= sufficient[0]))
+            if len(retry):
+                candidates = x[idx[retry]][None] + LINE_SEARCH_STEPS[1:, None, None] * direction[retry][None]
+                candidate_values[1:, retry] = self._objective(
+                    candidates.reshape((n_steps - 1) * len(retry), -1),
+                    np.tile(idx[retry], n_steps - 1)).reshape(n_steps - 1, len(retry))
+            armijo = candidate_values <= sufficient
+            accepted = armijo.any(axis=0)
+            chosen = np.argmax(armijo, axis=0)
+
+            # Series without an acceptable step have converged as far as possible
+            stalled = idx[~accepted]
+            converged[stalled] = np.abs(gradient[stalled]).max(axis=1) < gtol * 100
+            active[stalled] = False
+
+            idx, chosen = idx[accepted], chosen[accepted]
+            if not len(idx):
+                continue
+            step = LINE_SEARCH_STEPS[chosen][:, None] * direction[accepted]
+            new_x = x[idx] + step
+            new_value = candidate_values[chosen, np.flatnonzero(accepted)]
+            new_gradient = self._gradient(new_x, idx)
+
+            # BFGS update of the inverse Hessian approximation
+            change = new_gradient - gradient[idx]
+            curvature = np.einsum('ni,ni->n', step, change)
+            update = curvature > 1e-12
+            scale = np.where(first_step[idx] & update,
+                             curvature / np.maximum(np.einsum('ni,ni->n', change, change), 1e-300), 1.0)
+            hessian = inverse_hessian[idx] * scale[:, None, None]
+            rho = np.where(update, 1.0 / np.where(update, curvature, 1.0), 0.0)
+            identity = np.eye(self.k_params)[None]
+            left = identity - rho[:, None, None] * step[:, :, None] * change[:, None, :]
+            hessian = left @ hessian @ left.transpose(0, 2, 1) + rho[:, None, None] * step[:, :, None] * step[:, None, :]
+            inverse_hessian[idx] = np.where(update[:, None, None], hessian, inverse_hessian[idx])
+            first_step[idx] &= ~update
+
+            small_change = np.abs(value[idx] - new_value) <= ftol * np.maximum(np.abs(value[idx]), 1.0)
+            x[idx], value[idx], gradient[idx] = new_x, new_value, new_gradient
+            converged[idx[small_change]] = True
+            active[idx[small_change]] = False
+
+        self.iterations = iteration + 1
+        self.converged = converged
+        self.unconstrained_params = x
+        self.params = self._to_params(x, rows)
+        self.llf = self.loglike(self.params)
+        return self
+
+    @property
+    def aic(self):
+        return -2 * self.llf + 2 * self.k_params
+
+    @property
+    def bic(self):
+        return -2 * self.llf + np.log(np.maximum(self.nobs_effective, 1)) * self.k_params
+
+    # Forecasting ------------------------------------------------------------------------
+
+    def forecast_differenced(self, steps, exog=None, params=None):
+        # Forecasts of the differenced series and the covariance of their errors across
+        # horizons: (n_series, steps) and (n_series, steps, steps)
+        params = self.params if params is None else np.atleast_2d(params)
+        _, d, _ = self.order
+        _, D, _, s = self.seasonal_order
+        n = params.shape[0]
+
+        # Differenced future exog, computed from the observed exog followed by the future values
+        exog = np.zeros((n, steps, self.k_exog)) if exog is None else np.asarray(exog, dtype=float)
+        future_z = difference(np.concatenate([self.exog, exog], axis=1), d, D, s)[:, -steps:]
+        beta = params[:, :self.k_exog]
+
+        _, state, cov = self._filter(params)
+        transition, state_cov, _ = self._state_space(params)
+
+        w_mean = np.zeros((n, steps))
+        covs = []
+        for h in range(steps):
+            w_mean[:, h] = np.einsum('nk,nk->n', future_z[:, h], beta) + state[:, 0]
+            covs.append(cov)
+            state = np.einsum('nij,nj->ni', transition, state)
+            cov = transition @ cov @ transition.transpose(0, 2, 1) + state_cov
+        w_cov = np.zeros((n, steps, steps))
+        for i in range(steps):
+            propagated = covs[i]
+            for j in range(i, steps):
+                w_cov[:, i, j] = w_cov[:, j, i] = propagated[:, 0, 0]
+                propagated = transition @ propagated
+        return w_mean, w_cov
+
+    def forecast(self, steps, exog=None, alpha=0.05, params=None):
+        # Forecasts of the (undifferenced) series and (1 - alpha) prediction intervals.
+        # `exog` holds the future exogenous values as (n_series, steps, k_exog).
+        # Returns means (n_series, steps) and intervals (n_series, steps, 2).
+        params = self.params if params is None else np.atleast_2d(params)
+        _, d, _ = self.order
+        _, D, _, s = self.seasonal_order
+        n = params.shape[0]
+        w_mean, w_cov = self.forecast_differenced(steps, exog, params)
+
+        # Undo the differencing: y_t = w_t + sum_i c_i y_(t-i)
+        coefficients = integration_coefficients(d, D, s)
+        history = self.endog[:, self.endog.shape[1] - len(coefficients):] if len(coefficients) else self.endog[:, :0]
+        levels = np.concatenate([history, np.zeros((n, steps))], axis=1)
+        for h in range(steps):
+            t = len(coefficients) + h
+            levels[:, t] = w_mean[:, h] + levels[:, t - len(coefficients):t][:, ::-1] @ coefficients
+        mean = levels[:, len(coefficients):]
+
+        # Forecast errors of the levels are psi-weighted sums of the differenced errors
+        psi = np.zeros(steps)
+        psi[0] = 1
+        for h in range(1, steps):
+            psi[h] = sum(coefficients[i - 1] * psi[h - i] for i in range(1, min(h, len(coefficients)) + 1))
+        weights = np.array([[psi[i - j] if i >= j else 0.0 for j in range(steps)] for i in range(steps)])
+        y_cov = weights[None] @ w_cov @ weights.T[None]
+        std_error = np.sqrt(np.maximum(np.diagonal(y_cov, axis1=1, axis2=2), 0))
+
+        critical = norm.ppf(1 - alpha / 2)
+        intervals = np.stack([mean - critical * std_error, mean + critical * std_error], axis=2)
+        return mean, intervals
+
+
+def batch_forecast(series, steps, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER,
+                   orders=None, alpha=0.05):
+    # Fit and forecast a list of (name, production, exog_data) with the batched engine,
+    # one batch per distinct model order. The exogenous variables keep their last values
+    # over the forecast period, as in sarimax_core.forecast_sarimax. Exogenous columns
+    # without an identified coefficient (see identified_columns) are left out per batch.
+    # Returns {name: {'forecast', 'intervals', 'diagnostics', 'error'}}.
+    groups = {}
+    for name, production, exog_data in series:
+        spec = (orders or {}).get(name, (order, seasonal_order))
+        groups.setdefault((tuple(spec[0]), tuple(spec[1])), []).append((name, production, exog_data))
+
+    results = {}
+    for (group_order, group_seasonal_order), members in groups.items():
+        _, d, _ = group_order
+        _, D, _, s = group_seasonal_order
+        columns = identified_columns([exog for _, _, exog in members], group_order, group_seasonal_order)
+        k_params = len(columns) + sum(group_order) - d + sum(group_seasonal_order[:3]) - D + 1
+
+        # Series without enough observations after differencing cannot be estimated reliably
+        usable = []
+        for name, production, exog_data in members:
+            nobs = len(production) - d - D * s
+            if nobs < MIN_OBSERVATIONS_PER_PARAM * k_params:
+                results[name] = {'forecast': None, 'intervals': None, 'diagnostics': None,
+                                 'error': f"Too few observations after differencing ({nobs}) for {k_params} "
+                                          f"parameters; use the statsmodels engine for this series."}
+            else:
+                usable.append((name, production, exog_data))
+        if not usable:
+            continue
+
+        model = BatchSARIMAX([production for _, production, _ in usable], [exog[:, columns] for _, _, exog in usable],
+                             group_order, group_seasonal_order).fit()
+        future_exog = np.stack([np.tile(exog[-1, columns], (steps, 1)) for _, _, exog in usable])
+        means, intervals = model.forecast(steps, future_exog, alpha=alpha)
+        for i, (name, _, _) in enumerate(usable):
+            results[name] = {
+                'forecast': means[i],
+                'intervals': intervals[i],
+                'diagnostics': {
+                    'nobs': int(model.nobs_effective[i]),
+                    'aic': float(model.aic[i]),
+                    'bic': float(model.bic[i]),
+                    'llf': float(model.llf[i]),
+                    'converged': bool(model.converged[i]),
+                    'iterations': model.iterations,
+                    'exog_dropped': members[0][2].shape[1] - len(columns),
+                },
+                'error': None if np.isfinite(model.llf[i]) else "Batched fit did not produce a finite likelihood.",
+            }
+    return results
+
+
+def agreement_report(production, exog_data, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER,
+                     steps=3):
+    # Compare the batched engine with statsmodels for one series. SARIMAX with
+    # simple_differencing=True has the same likelihood and the same forecasts of the
+    # differenced series, so at its estimates the loglikelihoods, forecast means and
+    # forecast variances must agree to rounding error; both use the identified exogenous
+    # columns, as batch_forecast does. The batched forecasts at the engine's own estimates
+    # are also compared with the default SARIMAX of objective3_sarimax on all columns,
+    # whose likelihood handles the differencing inside the state space.
+    future_exog = np.tile(exog_data[-1], (steps, 1))
+    columns = identified_columns([exog_data], order, seasonal_order)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        reference = SARIMAX(production, exog=exog_data[:, columns], order=order, seasonal_order=seasonal_order,
+                            simple_differencing=True).fit(disp=False)
+        dashboard = build_model(production, exog_data, order, seasonal_order).fit(disp=False)
+    reference_forecast = reference.get_forecast(steps, exog=future_exog[:, columns])
+
+    model = BatchSARIMAX([production], [exog_data[:, columns]], order, seasonal_order)
+    reference_params = np.asarray(reference.params)[None]
+    w_mean, w_cov = model.forecast_differenced(steps, future_exog[None][:, :, columns], reference_params)
+    llf_at_reference = float(model.loglike(reference_params)[0])
+    model.fit()
+    forecast = model.forecast(steps, future_exog[None][:, :, columns])[0][0]
+
+    def relative_difference(values, expected):
+        expected = np.asarray(expected)
+        return float(np.max(np.abs(values - expected) / np.maximum(np.abs(expected), 1e-8)))
+
+    return {
+        'llf_statsmodels': float(reference.llf),
+        'llf_batch_at_statsmodels_params': llf_at_reference,
+        'llf_batch': float(model.llf[0]),
+        'llf_diff_at_statsmodels_params': relative_difference(llf_at_reference, reference.llf),
+        'mean_diff_at_statsmodels_params': relative_difference(w_mean[0], reference_forecast.predicted_mean),
+        'variance_diff_at_statsmodels_params': relative_difference(np.diagonal(w_cov[0]),
+                                                                   reference_forecast.var_pred_mean),
+        'forecast_diff_dashboard': relative_difference(forecast, dashboard.forecast(steps, exog=future_exog)),
+    }
+
+
+def agreement_failures(report, tolerances=AGREEMENT_TOLERANCES):
+    # Checks of an agreement_report whose relative difference exceeds its tolerance
+    return [check for check, tolerance in tolerances.items() if not report[check] <= tolerance]
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import statsmodels
+
+from batch_sarimax import batch_forecast
+from data_cleaning import clean_dataset
+from data_loading import DATE_COLUMNS, NUMERIC_COLUMNS, read_dataset
+from obj4 import correlation_analysis
+from sarimax_core import EXOGENOUS_VARS, collect_series, fit_series, forecast_sarimax
+
+# Benchmarks for the dashboard's processing stages on synthetic datasets with the schema of
+# data/smdatasets.csv, scaled up in the number of municipalities and in series length.
+# Every stage is timed separately and run a second time under tracemalloc for its peak traced
+# memory, and the results are written as JSON so that runs before and after a change can be compared.
+#
+#   python benchmark.py --scales 10 100 --output before.json
+#   python benchmark.py --scales 10 100 --output after.json --compare before.json
+
+DEFAULT_TEMPLATE = "data/smdatasets.csv"
+DEFAULT_SCALES = [10, 100, 1000]
+DEFAULT_OUTPUT = "benchmark_results.json"
+STAGES = ['load', 'clean', 'fit', 'forecast', 'correlation']
+
+# Synthetic dates stay within this many years, so long series get more rows per year
+MAX_YEARS = 200
+
+FORECAST_STEPS = 3
+
+
+def generate_dataset(template, n_municipalities, rows_per_municipality, seed=0):
+    # Synthetic dataset in the template's schema. Every municipality repeats the rows of the
+    # template's first municipality, with numeric values scaled by a per-municipality factor
+    # and per-row noise, alternating Dry/Wet seasons and years ending at the template's last year.
+    rng = np.random.default_rng(seed)
+    base = template[template['Municipality'] == template['Municipality'].iloc[0]].reset_index(drop=True)
+    n_rows = n_municipalities * rows_per_municipality
+    position = np.tile(np.arange(rows_per_municipality), n_municipalities)
+    municipality = np.repeat(np.arange(n_municipalities), rows_per_municipality)
+
+    df = base.iloc[position % len(base)].drop(columns=['Year']).reset_index(drop=True)
+    df['Row_ID'] = np.arange(1, n_rows + 1)
+    df['Municipality'] = pd.Series([f"Municipality{i + 1:04d}" for i in range(n_municipalities)])[municipality].values
+    df['Season'] = np.where(position % 2, 'Wet', 'Dry')
+
+    factors = rng.uniform(0.5, 2.0, n_municipalities)[municipality] * rng.normal(1.0, 0.05, n_rows)
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = (df[column] * factors).round(4)
+
+    rows_per_year = max(2, -(-rows_per_municipality // MAX_YEARS))
+    years = int(base['Year'].max()) - (rows_per_municipality - 1 - position) // rows_per_year
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            dates = pd.to_datetime(df[column])
+            df[column] = (dates.dt.month.astype(str) + '/' + dates.dt.day.clip(upper=28).astype(str)
+                          + '/' + pd.Series(years).astype(str))
+    return df
+
+
+def measure(function, *args, **kwargs):
+    # Run `function` twice: once untraced for the wall time, since tracemalloc slows down
+    # allocation-heavy stages more than others, and once traced for the peak memory.
+    # Returns the result of the timed run, the wall time and the peak traced memory.
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {'seconds': round(seconds, 6), 'peak_memory_mb': round(peak / 2 ** 20, 3)}
+
+
+def fit_all(cleaned, municipalities, engine, workers):
+    # Stage 'fit' (for the batched engine including the forecasts): one fit per municipality
+    columns = [var for var in EXOGENOUS_VARS if var in cleaned.columns]
+    series = collect_series(cleaned, municipalities, columns)
+    series_batch = [(name, production, exog_data) for name, (_, production, exog_data, _) in series.items()]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if engine == "batched":
+            return series, batch_forecast(series_batch, FORECAST_STEPS)
+        return series, {name: fit_model for name, fit_model, _, _ in
+                        fit_series(series_batch, columns, max_workers=workers, incremental=False)}
+
+
+def forecast_all(series, fits):
+    return {name: forecast_sarimax(fit_model, series[name][0], series[name][2], FORECAST_STEPS)
+            for name, fit_model in fits.items() if fit_model is not None}
+
+
+def run_dataset(name, path, stages, engine, workers):
+    # Run the stages in pipeline order on one dataset; returns one result row per stage
+    measurements = {}
+    df, measurements['load'] = measure(read_dataset, path)
+    (cleaned, municipalities), measurements['clean'] = measure(clean_dataset, df)
+    if 'fit' in stages or 'forecast' in stages:
+        (series, fits), measurements['fit'] = measure(fit_all, cleaned, municipalities, engine, workers)
+        if engine != "batched":
+            _, measurements['forecast'] = measure(forecast_all, series, fits)
+    if 'correlation' in stages:
+        start_date = df['Planting_Date'].min()
+        end_date = df['Harvesting_Date'].max()
+        _, measurements['correlation'] = measure(correlation_analysis, cleaned, municipalities, start_date, end_date)
+
+    return [{'dataset': name, 'municipalities': int(df['Municipality'].nunique()), 'rows': len(df),
+             'stage': stage, **measurement}
+            for stage, measurement in measurements.items() if stage in stages]
+
+
+def compare(results, previous):
+    # Print the change of every (dataset, stage) measurement relative to an earlier run
+    earlier = {(row['dataset'], row['stage']): row for row in previous['results']}
+    print(f"{'dataset':<22}{'stage':<13}{'seconds':>10}{'before':>10}{'ratio':>8}{'peak MB':>10}{'before':>10}")
+    for row in results:
+        old = earlier.get((row['dataset'], row['stage']))
+        if old is None:
+            continue
+        ratio = row['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        print(f"{row['dataset']:<22}{row['stage']:<13}{row['seconds']:>10.3f}{old['seconds']:>10.3f}"
+              f"{ratio:>8.2f}{row['peak_memory_mb']:>10.1f}{old['peak_memory_mb']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's processing stages on synthetic data.")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE,
+                        help=f"Dataset whose schema and values are scaled up (default: {DEFAULT_TEMPLATE}).")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="Scale factors; each one benchmarks a dataset with that many times the "
+                             "municipalities and one with that many times the series length (default: 10 100 1000).")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES,
+                        help="Stages to record (load and clean always run, they feed the others).")
+    parser.add_argument("--engine", choices=["statsmodels", "batched"], default="statsmodels",
+                        help="Fitting engine; the batched engine's fit stage includes the forecasts.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Fit processes (default: 1; memory of worker processes is not traced).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0).")
+    parser.add_argument("--data-dir", help="Keep the generated CSVs in this directory.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"Results file (default: {DEFAULT_OUTPUT}).")
+    parser.add_argument("--compare", help="Earlier results file to compare with.")
+    args = parser.parse_args(argv)
+
+    template = read_dataset(args.template)
+    base_municipalities = template['Municipality'].nunique()
+    base_rows = int(template.groupby('Municipality', observed=True).size().max())
+    datasets = []
+    for scale in args.scales:
+        datasets.append((f"municipalities_x{scale}", base_municipalities * scale, base_rows))
+        datasets.append((f"length_x{scale}", base_municipalities, base_rows * scale))
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for name, n_municipalities, rows_per_municipality in datasets:
+            path = os.path.join(data_dir, f"{name}.csv")
+            generate_dataset(template, n_municipalities, rows_per_municipality, args.seed).to_csv(path, index=False)
+            rows = run_dataset(name, path, args.stages, args.engine, args.workers)
+            for row in rows:
+                print(f"{row['dataset']:<22}{row['stage']:<13}{row['seconds']:>10.3f} s{row['peak_memory_mb']:>10.1f} MB")
+            results.extend(rows)
+
+    report = {
+        'metadata': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'packages': {'numpy': np.__version__, 'pandas': pd.__version__, 'statsmodels': statsmodels.__version__},
+            'template': args.template,
+            'seed': args.seed,
+            'engine': args.engine,
+            'workers': args.workers,
+        },
+        'results': results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# Plotly figures of the dashboard, built without Streamlit calls so the objectives can
+# cache them by their input data. Long traces are downsampled before they are sent to
+# the browser, which keeps the chart JSON small for large selections.
+
+# Points kept per trace; min/max downsampling keeps the peaks and troughs
+MAX_POINTS_PER_TRACE = 400
+
+# Line colors of the scenario comparison, the baseline first
+SCENARIO_COLORS = ['#ef553b', '#00cc96', '#ab63fa', '#ffa15a', '#19d3f3', '#ff6692', '#b6e880', '#ff97ff', '#fecb52']
+
+# Panels per row and height per row (px) of the small-multiples view
+SMALL_MULTIPLES_COLUMNS = 3
+SMALL_MULTIPLES_ROW_HEIGHT = 260
+
+
+def downsample(x, y, max_points=MAX_POINTS_PER_TRACE):
+    # Keep the first and last point and the minimum and maximum of each of max_points / 2
+    # equally sized buckets, in their original order
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_points:
+        return x, y
+    buckets = max(max_points // 2, 1)
+    size = -(-n // buckets)
+    padding = buckets * size - n
+    lows = np.concatenate((np.where(np.isnan(y), np.inf, y), np.full(padding, np.inf))).reshape(buckets, size)
+    highs = np.concatenate((np.where(np.isnan(y), -np.inf, y), np.full(padding, -np.inf))).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    keep = np.concatenate(([0, n - 1], offsets + lows.argmin(axis=1), offsets + highs.argmax(axis=1)))
+    keep = np.unique(keep[keep < n])
+    return x[keep], y[keep]
+
+
+def forecast_figure(municipality, years, production, forecast_years, forecast_values):
+    # Historical production, the connecting segment and the forecast of one municipality
+    history_x, history_y = downsample(years, production)
+    residual_years = np.concatenate(([years[-1]], forecast_years))
+    residual_values = np.concatenate(([production[-1]], forecast_values))
+
+    fig = go.Figure()
+
+    # Historical data (blue)
+    fig.add_trace(go.Scatter(
+        x=history_x, y=history_y,
+        mode='lines', name='Historical Production',
+        line=dict(color='blue'),
+        hovertemplate='Year: %{x}<br>Historical Production: %{y:.2f} MT'
+    ))
+
+    # Residual data (green)
+    fig.add_trace(go.Scatter(
+        x=residual_years, y=residual_values,
+        mode='lines', name='Residual Production',
+        line=dict(color='green'),
+        hovertemplate='Year: %{x}<br>Residual Production: %{y:.2f} MT'
+    ))
+
+    # Forecasted data (red)
+    fig.add_trace(go.Scatter(
+        x=forecast_years, y=forecast_values,
+        mode='lines', name='Forecasted Production',
+        line=dict(color='red'),
+        hovertemplate='Year: %{x}<br>Forecasted Production: %{y:.2f} MT'
+    ))
+
+    fig.update_layout(
+        title=f"SARIMAX Forecast for {municipality}",
+        xaxis_title="Year",
+        yaxis_title="Total Production (MT)",
+        legend_title="Data",
+        hovermode="x unified",
+        template="plotly_dark"
+    )
+    return fig
+
+
+def small_multiples_figure(panels, columns=SMALL_MULTIPLES_COLUMNS, max_points=MAX_POINTS_PER_TRACE):
+    # One figure with a panel per (municipality, years, production, forecast_years,
+    # forecast_values); the forecast line starts at the last historical point
+    rows = max(-(-len(panels) // columns), 1)
+    fig = make_subplots(
+        rows=rows, cols=columns, subplot_titles=[str(panel[0]) for panel in panels],
+        vertical_spacing=min(0.08, 0.3 / rows), horizontal_spacing=0.06
+    )
+    for i, (municipality, years, production, forecast_years, forecast_values) in enumerate(panels):
+        row, col = i // columns + 1, i % columns + 1
+        history_x, history_y = downsample(years, production, max_points)
+        fig.add_trace(go.Scatter(
+            x=history_x, y=history_y,
+            mode='lines', name='Historical Production', legendgroup='history', showlegend=i == 0,
+            line=dict(color='blue', width=1),
+            hovertemplate=f'{municipality}<br>Year: %{{x}}<br>Historical Production: %{{y:.2f}} MT<extra></extra>'
+        ), row=row, col=col)
+        fig.add_trace(go.Scatter(
+            x=np.concatenate(([years[-1]], forecast_years)), y=np.concatenate(([production[-1]], forecast_values)),
+            mode='lines', name='Forecasted Production', legendgroup='forecast', showlegend=i == 0,
+            line=dict(color='red', width=1),
+            hovertemplate=f'{municipality}<br>Year: %{{x}}<br>Forecasted Production: %{{y:.2f}} MT<extra></extra>'
+        ), row=row, col=col)
+    fig.update_layout(
+        title="SARIMAX Forecasts",
+        height=SMALL_MULTIPLES_ROW_HEIGHT * rows + 120,
+        legend_title="Data",
+        template="plotly_dark"
+    )
+    fig.update_annotations(font_size=12)
+    return fig
+
+
+def _rgba(color, opacity):
+    return f"rgba({int(color[1:3], 16)}, {int(color[3:5], 16)}, {int(color[5:7], 16)}, {opacity})"
+
+
+def scenario_figure(municipality, years, production, forecast_years, names, means, intervals):
+    # History and the forecast of every scenario with its prediction interval band
+    history_x, history_y = downsample(years, production)
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=history_x, y=history_y,
+        mode='lines', name='Historical Production',
+        line=dict(color='blue'),
+        hovertemplate='Year: %{x}<br>Historical Production: %{y:.2f} MT'
+    ))
+    for i, name in enumerate(names):
+        color = SCENARIO_COLORS[i % len(SCENARIO_COLORS)]
+        fig.add_trace(go.Scatter(
+            x=np.concatenate((forecast_years, forecast_years[::-1])),
+            y=np.concatenate((intervals[i, :, 1], intervals[i, ::-1, 0])),
+            fill='toself', fillcolor=_rgba(color, 0.12), line=dict(width=0),
+            legendgroup=name, hoverinfo='skip', showlegend=False
+        ))
+        fig.add_trace(go.Scatter(
+            x=np.concatenate(([years[-1]], forecast_years)), y=np.concatenate(([production[-1]], means[i])),
+            mode='lines+markers', name=name, legendgroup=name,
+            line=dict(color=color, dash=None if i == 0 else 'dash'),
+            hovertemplate=f'{name}<br>Year: %{{x}}<br>Forecasted Production: %{{y:.2f}} MT<extra></extra>'
+        ))
+    fig.update_layout(
+        title=f"Scenario Forecasts for {municipality}",
+        xaxis_title="Year",
+        yaxis_title="Total Production (MT)",
+        legend_title="Scenario",
+        hovermode="x unified",
+        template="plotly_dark"
+    )
+    return fig
+
+
+def heatmap_figure(correlation_matrix, title="Correlation Heatmap"):
+    # Interactive heatmap of a correlation matrix with the values printed in the cells
+    labels = [str(label) for label in correlation_matrix.columns]
+    fig = go.Figure(go.Heatmap(
+        z=correlation_matrix.to_numpy(), x=labels, y=[str(label) for label in correlation_matrix.index],
+        zmin=-1, zmax=1, colorscale='RdBu_r',
+        texttemplate='%{z:.2f}', textfont=dict(size=12),
+        colorbar=dict(title='Correlation Value'),
+        hovertemplate='%{y}<br>%{x}<br>Correlation: %{z:.2f}<extra></extra>'
+    ))
+    fig.update_layout(
+        title=title,
+        height=700,
+        xaxis=dict(tickangle=-45),
+        yaxis=dict(autorange='reversed'),
+        template="plotly_dark"
+    )
+    return fig
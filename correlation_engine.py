@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+from data_cleaning import RICE_ECOSYSTEM_CODES, SEASON_CODES, as_datetime, encode_codes
+
+# Correlation matrices of the focus variables per municipality, per season and pooled,
+# computed from grouped sufficient statistics (row count, column sums and cross-products
+# per (municipality, season)). The statistics are additive, so one pass over the rows
+# serves every grouping, and appended rows only add their own statistics.
+
+SEASONAL_VARS = ['Season', 'Planting_Date', 'Harvesting_Date']
+EXOGENOUS_VARS = [
+    'Rice_Ecosystem', 'Certified_Seeds_Area_Harvested(Ha)',
+    'Hybrid_Seeds_Area_Harvested_(Ha)', 'Total_Area_Harvested(Ha)',
+    'Certified_Seeds_Production(MT)', 'Hybrid_Seeds_Production_(MT)'
+]
+FOCUS_VARS = SEASONAL_VARS + EXOGENOUS_VARS + ['Total_Production(MT)']
+
+# Correlations above this (in absolute value) are reported as strong
+STRONG_CORRELATION = 0.7
+
+# Columns whose variance is below this fraction of their second moment count as constant
+# (their shifted cross-products leave only rounding noise)
+VARIANCE_TOLERANCE = 1e-10
+
+# Rows per block when accumulating cross-products, bounding the temporary memory
+BLOCK_ROWS = 65536
+
+
+class GroupedCorrelation:
+    # Sufficient statistics of the focus variables per (municipality, season). Values are
+    # shifted by the means of the first batch before accumulating, which keeps the
+    # cross-products well conditioned for large magnitudes such as production in MT.
+
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns is not None else None
+        self.season_codes = dict(SEASON_CODES)
+        self.groups = {}
+        self.shift = None
+        self.counts = np.zeros(0)
+        self.sums = None
+        self.cross = None
+
+    def _seasons(self, df):
+        # (labels, codes) of the Season column, which may hold labels or the codes of
+        # data_cleaning.SEASON_CODES. Unknown labels get new codes, so the codes of a
+        # season never change between updates.
+        if 'Season' not in df.columns:
+            return np.full(len(df), ''), np.zeros(len(df))
+        if pd.api.types.is_numeric_dtype(df['Season']):
+            names = {code: label for label, code in self.season_codes.items()}
+            codes = df['Season'].to_numpy(dtype=float)
+            return np.array([names.get(code, str(code)) for code in codes], dtype=object), codes
+        labels = df['Season'].astype(str)
+        for label in sorted(set(labels.unique()) - set(self.season_codes)):
+            self.season_codes[label] = max(self.season_codes.values(), default=0) + 1
+        return labels.to_numpy(dtype=object), labels.map(self.season_codes).to_numpy(dtype=float)
+
+    def _encode(self, df, season_codes):
+        # Numeric matrix of the focus columns; dates become day-of-year
+        columns = []
+        for column in self.columns:
+            if column == 'Season':
+                columns.append(season_codes)
+            elif column in ('Planting_Date', 'Harvesting_Date'):
+                columns.append(as_datetime(df[column]).dt.dayofyear.to_numpy(dtype=float))
+            elif column == 'Rice_Ecosystem':
+                columns.append(encode_codes(df[column], RICE_ECOSYSTEM_CODES).to_numpy(dtype=float))
+            else:
+                columns.append(pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float))
+        return np.column_stack(columns) if columns else np.empty((len(df), 0))
+
+    def update(self, df):
+        # Add the rows of `df` (with Municipality and the focus columns). Rows with missing
+        # values are skipped, like the complete-case analysis of DataFrame.dropna().
+        df = df.dropna()
+        if self.columns is None:
+            self.columns = [var for var in FOCUS_VARS if var in df.columns]
+        seasons, season_codes = self._seasons(df)
+        values = self._encode(df, season_codes)
+        complete = np.isfinite(values).all(axis=1)
+        values = values[complete]
+        keys = pd.MultiIndex.from_arrays([df['Municipality'].astype(str).to_numpy()[complete], seasons[complete]])
+        if not len(values):
+            return self
+
+        if self.shift is None:
+            self.shift = values.mean(axis=0)
+            k = len(self.columns)
+            self.sums = np.zeros((0, k))
+            self.cross = np.zeros((0, k, k))
+        values = values - self.shift
+
+        # Map the batch's keys to group rows, adding rows for new groups
+        batch_codes, batch_keys = pd.factorize(keys)
+        rows = np.empty(len(batch_keys), dtype=np.intp)
+        for i, key in enumerate(batch_keys):
+            if key not in self.groups:
+                self.groups[key] = len(self.groups)
+            rows[i] = self.groups[key]
+        self._grow(len(self.groups))
+
+        # One pass: sort rows by group and reduce each contiguous run of a group
+        order = np.argsort(batch_codes, kind='stable')
+        codes = rows[batch_codes[order]]
+        values = values[order]
+        self.counts += np.bincount(codes, minlength=len(self.counts))
+        for start in range(0, len(values), BLOCK_ROWS):
+            block_codes = codes[start:start + BLOCK_ROWS]
+            block = values[start:start + BLOCK_ROWS]
+            starts = np.flatnonzero(np.r_[True, block_codes[1:] != block_codes[:-1]])
+            groups = block_codes[starts]
+            self.sums[groups] += np.add.reduceat(block, starts, axis=0)
+            self.cross[groups] += np.add.reduceat(block[:, :, None] * block[:, None, :], starts, axis=0)
+        return self
+
+    def _grow(self, n_groups):
+        extra = n_groups - len(self.counts)
+        if extra > 0:
+            k = len(self.columns)
+            self.counts = np.concatenate((self.counts, np.zeros(extra)))
+            self.sums = np.concatenate((self.sums, np.zeros((extra, k))))
+            self.cross = np.concatenate((self.cross, np.zeros((extra, k, k))))
+
+    def _select(self, municipalities=None, seasons=None):
+        return [row for (municipality, season), row in self.groups.items()
+                if (municipalities is None or municipality in municipalities)
+                and (seasons is None or season in seasons)]
+
+    def _correlation(self, rows):
+        # Pearson correlation of the pooled groups; NaN for constant columns or < 2 rows
+        count = self.counts[rows].sum()
+        if count < 2:
+            return pd.DataFrame(np.nan, index=self.columns, columns=self.columns)
+        mean = self.sums[rows].sum(axis=0) / count
+        second_moment = self.cross[rows].sum(axis=0) / count
+        covariance = second_moment - np.outer(mean, mean)
+        variance = np.diag(covariance)
+        scale = np.where(variance > VARIANCE_TOLERANCE * np.diag(second_moment), np.sqrt(np.abs(variance)), 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            matrix = covariance / np.outer(scale, scale)
+        matrix[np.outer(scale, scale) <= 0] = np.nan
+        matrix = np.clip(matrix, -1, 1)
+        np.fill_diagonal(matrix, np.where(scale > 0, 1.0, np.nan))
+        return pd.DataFrame(matrix, index=self.columns, columns=self.columns)
+
+    def matrix(self, municipalities=None, seasons=None):
+        # Correlation matrix pooled over the selected municipalities and seasons (default: all)
+        return self._correlation(self._select(municipalities, seasons))
+
+    def by_municipality(self, municipalities=None):
+        names = sorted({municipality for municipality, _ in self.groups})
+        return {name: self.matrix([name]) for name in names if municipalities is None or name in municipalities}
+
+    def by_season(self, municipalities=None):
+        seasons = sorted({season for _, season in self.groups})
+        return {season: self.matrix(municipalities, [season]) for season in seasons}
+
+
+def strong_pairs(correlation_matrix, threshold=STRONG_CORRELATION):
+    # Pairs of distinct variables with |correlation| above the threshold, each pair once
+    matrix = correlation_matrix.to_numpy()
+    first, second = np.triu_indices(len(matrix), k=1)
+    values = matrix[first, second]
+    strong = np.abs(values) > threshold
+    return pd.DataFrame({
+        'Variable 1': correlation_matrix.index[first[strong]],
+        'Variable 2': correlation_matrix.columns[second[strong]],
+        'Correlation': values[strong],
+    })
+
+
+def filter_period(df, municipalities, start_date, end_date):
+    return df[
+        (df['Municipality'].isin(municipalities)) &
+        (as_datetime(df['Planting_Date']) >= pd.to_datetime(start_date)) &
+        (as_datetime(df['Harvesting_Date']) <= pd.to_datetime(end_date))
+    ]
@@ -2,12 +2,21 @@ import streamlit as st
 import pandas as pd
 import os
 
+from data_loading import load_dataset, load_dataset_file
+from dataset_store import DEFAULT_STORE_DIR, DatasetStore, store_exists, store_version
+from instrumentation import span, start_profile, start_recording, stop_profile
 from obj1 import objective1
 from obj3Sarimax import objective3_sarimax
 from obj4 import objective4
+from obj5Backtest import objective5_backtest
+from obj6Hierarchy import objective6_hierarchy
+from streaming_ingest import STREAMING_THRESHOLD_BYTES, StreamingCSVSource
 
 # Streamlit app configuration
 st.set_page_config(page_title="SARIMAX for Rice Production", page_icon=":ear_of_rice:", layout="wide")
+
+# Timing spans of this rerun, shown in the sidebar's Performance panel
+recorder = start_recording()
 st.title("Application of SARIMAX for Agricultural Rice Production")
 st.write("Seasonal Auto-Regressive Integrated Moving Average with Exogenous Regressor")
 
@@ -15,23 +24,103 @@ st.write("Seasonal Auto-Regressive Integrated Moving Average with Exogenous Regr
 with open("app.css") as f:
     st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
+@st.cache_resource
+def get_dataset_store(store_dir, version):
+    # Re-created whenever an ingest changes the store's manifest (version)
+    return DatasetStore(store_dir)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_streaming_source(file_id, _uploaded_file):
+    # Large uploads are read in chunks into a temporary columnar file instead of one DataFrame;
+    # kept per upload (file_id), and the temporary file is removed when the entry is evicted
+    progress_bar = st.progress(0.0, text="Reading the uploaded file...")
+
+    def report(bytes_read, total_bytes, rows):
+        progress_bar.progress(min(bytes_read / total_bytes, 1.0),
+                              text=f"Reading the uploaded file... {rows:,} rows kept")
+
+    _uploaded_file.seek(0)
+    source = StreamingCSVSource(_uploaded_file, progress=report)
+    progress_bar.empty()
+    return source
+
+def render_performance_panel(panel, recorder, profile_text=None):
+    # Stage timings and per-municipality fits of this rerun, with a JSON export for monitoring
+    panel.write(f"This run took {recorder.elapsed():.2f} s.")
+    totals = recorder.totals()
+    if totals:
+        panel.dataframe(pd.DataFrame([
+            {'Span': name, 'Count': total['count'], 'Seconds': round(total['seconds'], 3)}
+            for name, total in totals.items()
+        ]), hide_index=True)
+    fits = [entry for entry in recorder.spans if entry['name'] == 'fit']
+    if fits:
+        panel.write("Model fits")
+        panel.dataframe(pd.DataFrame([
+            {'Municipality': entry['attributes'].get('series'), 'Mode': entry['attributes'].get('mode'),
+             'Seconds': round(entry['seconds'], 3), 'Iterations': entry['attributes'].get('iterations'),
+             'Converged': entry['attributes'].get('converged')}
+            for entry in fits
+        ]), hide_index=True)
+    panel.download_button("Export spans (JSON)", data=recorder.to_json(indent=1),
+                          file_name="performance_spans.json", mime="application/json")
+    if profile_text:
+        panel.code(profile_text, language=None)
+
 # Sidebar for file uploader or default dataset
 st.sidebar.image("images/DALogo.jpg", use_column_width=True)
 
+# Collapsible panel with the timings of this rerun (filled in at the end of the script)
+performance_panel = st.sidebar.expander("Performance", expanded=False)
+capture_profile = performance_panel.checkbox(
+    "Capture cProfile", value=False,
+    help="Profile this rerun with cProfile; work done in worker processes is not included."
+)
+profiler = start_profile() if capture_profile else None
+
 # File uploader or default dataset handling
 uploaded_file = st.sidebar.file_uploader("Upload your CSV file", type=["csv"])
 
-# Initialize the 'df' variable
+# Initialize the 'df' variable (a DataFrame, or the dataset store which is read lazily)
 df = None
 
+# Offer the columnar dataset store when one has been ingested
+use_store = False
+if not uploaded_file and store_exists(DEFAULT_STORE_DIR):
+    use_store = st.sidebar.radio("Data source", ["Dataset store", "Default CSV file"]) == "Dataset store"
+
 # Check if an uploaded file exists or use the default path
-if uploaded_file:
-    df = pd.read_csv(uploaded_file)  # Read the uploaded file into a dataframe
+if uploaded_file and uploaded_file.size > STREAMING_THRESHOLD_BYTES:
+    with span('load_dataset', source='upload_stream', bytes=uploaded_file.size):
+        try:
+            df = get_streaming_source(uploaded_file.file_id, uploaded_file)
+        except ValueError as e:
+            st.error(f"Could not read the uploaded file: {e}")
+            st.stop()
+    if df.rejected:
+        st.warning(f"{df.rejected:,} rows without a valid date or municipality, or with missing values, were skipped.")
+    st.write("Dataset uploaded successfully!")
+elif uploaded_file:
+    with span('load_dataset', source='upload'):
+        try:
+            df = load_dataset(uploaded_file.getvalue())  # Parse the upload once; cached by content hash
+        except ValueError as e:
+            st.error(f"Could not read the uploaded file: {e}")
+            st.stop()
     st.write("Dataset uploaded successfully!")
+elif use_store:
+    with span('load_dataset', source='store'):
+        df = get_dataset_store(DEFAULT_STORE_DIR, store_version(DEFAULT_STORE_DIR))
+    st.write("Using dataset store!")
 else:
     default_path = "data/smdatasets.csv"
     if os.path.exists(default_path):
-        df = pd.read_csv(default_path)  # Load from the default path if the file exists or dataset
+        with span('load_dataset', source='file'):
+            try:
+                df = load_dataset_file(default_path)  # Load from the default path if the file exists or dataset
+            except ValueError as e:
+                st.error(f"Could not read the default dataset: {e}")
+                st.stop()
         st.write("Using default dataset!")
     else:
         st.error("Please upload a dataset or make sure the default file exists.")
@@ -40,18 +129,31 @@ else:
 # Check if dataframe is loaded
 if df is not None:
     # Objective 1: Data Cleaning & Municipality Selection
-    df_cleaned, selected_municipalities, start_year, end_year = objective1(df)
+    with span('objective1'):
+        df_cleaned, selected_municipalities, start_year, end_year = objective1(df)
 
     # Only proceed if municipalities are selected
     if len(selected_municipalities) > 0:
         # Pass the required parameters to objective3_sarimax
-        objective3_sarimax(df_cleaned, selected_municipalities, start_year, end_year)
+        with span('objective3_sarimax', municipalities=len(selected_municipalities)):
+            objective3_sarimax(df_cleaned, selected_municipalities, start_year, end_year)
+        
+        # Rolling-origin backtest of the forecasts (runs only when enabled in the sidebar)
+        with span('objective5_backtest'):
+            objective5_backtest(df_cleaned, selected_municipalities, start_year, end_year)
+        
+        # Reconciled municipality, province and region forecasts (runs only when enabled in the sidebar)
+        with span('objective6_hierarchy'):
+            objective6_hierarchy(df_cleaned, selected_municipalities, start_year, end_year)
         
         # Ensure dates for start and end year if objective4 needs date type
         start_date = pd.to_datetime(f"{start_year}-01-01")
         end_date = pd.to_datetime(f"{end_year}-12-31")
         
         # Pass cleaned data and selected municipalities to objective4
-        objective4(df_cleaned, selected_municipalities, start_date, end_date)
+        with span('objective4'):
+            objective4(df_cleaned, selected_municipalities, start_date, end_date)
     else:
         st.warning("Please select at least one municipality to proceed with the analysis.")
+
+render_performance_panel(performance_panel, recorder, stop_profile(profiler) if profiler is not None else None)
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Numeric codes used when converting the categorical columns
+SEASON_CODES = {'Dry': 1, 'Wet': 2}
+RICE_ECOSYSTEM_CODES = {'Rainfed': 1, 'Irrigated': 2}
+
+
+def as_datetime(values):
+    # Dates that were already parsed by the loading stage are returned unchanged
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, errors='coerce')
+
+
+def add_year_column(df):
+    # Convert 'Planting_Date' and 'Harvesting_Date' to datetime format and derive 'Year'
+    # from the first available one. Returns None if there is no date column.
+    date_columns = [column for column in ('Planting_Date', 'Harvesting_Date') if column in df.columns]
+    if 'Year' in df.columns and all(pd.api.types.is_datetime64_any_dtype(df[column]) for column in date_columns):
+        # Already typed by the loading stage; no copy needed
+        return df
+
+    df = df.copy()
+    for column in date_columns:
+        df[column] = as_datetime(df[column])
+
+    if 'Planting_Date' in df.columns:
+        df['Year'] = df['Planting_Date'].dt.year
+    elif 'Harvesting_Date' in df.columns:
+        df['Year'] = df['Harvesting_Date'].dt.year
+    else:
+        return None
+    return df
+
+
+def year_range(df):
+    return int(df['Year'].min()), int(df['Year'].max())
+
+
+def filter_year_range(df, start_year, end_year):
+    return df[(df['Year'] >= start_year) & (df['Year'] <= end_year)]
+
+
+def encode_codes(values, codes):
+    # Map labels to numeric codes; for categoricals only the categories are mapped.
+    # Columns that are already numeric are kept, unknown labels become NaN.
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    return values.map(codes).astype(float)
+
+
+def encode_categoricals(df):
+    # Convert 'Season' and 'Rice_Ecosystem' to their numeric codes
+    df = df.copy()
+    if 'Season' in df.columns:
+        df['Season'] = encode_codes(df['Season'], SEASON_CODES)
+    if 'Rice_Ecosystem' in df.columns:
+        df['Rice_Ecosystem'] = encode_codes(df['Rice_Ecosystem'], RICE_ECOSYSTEM_CODES)
+    return df
+
+
+def valid_rows(df):
+    # Boolean mask of rows without missing or infinite values
+    numeric = df.select_dtypes(include='number')
+    return df.notna().all(axis=1) & ~np.isinf(numeric.to_numpy(dtype=float)).any(axis=1)
+
+
+def filter_municipalities(df, municipalities):
+    # Keep the selected municipalities and drop rows with missing or infinite values,
+    # selecting rows with a single mask instead of several intermediate copies
+    return df[df['Municipality'].isin(municipalities) & valid_rows(df)]
+
+
+def clean_dataset(df, start_year=None, end_year=None, municipalities=None, convert_categoricals=True):
+    # Full cleaning pipeline of objective1 without any UI. Missing year bounds default to
+    # the dataset's range and missing municipalities to all of them.
+    df = add_year_column(df)
+    if df is None:
+        raise ValueError("No valid date columns found in the dataset.")
+    if 'Municipality' not in df.columns:
+        raise ValueError("Municipality column is not found in the dataset.")
+
+    min_year, max_year = year_range(df)
+    df = filter_year_range(df, min_year if start_year is None else start_year,
+                           max_year if end_year is None else end_year)
+    if convert_categoricals:
+        df = encode_categoricals(df)
+    if municipalities is None:
+        municipalities = df['Municipality'].unique().tolist()
+    return filter_municipalities(df, municipalities), municipalities
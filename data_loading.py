@@ -0,0 +1,112 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from data_cleaning import add_year_column, year_range
+from instrumentation import span
+
+# Dates in the datasets are written as month/day/year, e.g. 5/1/2003
+DATE_FORMAT = "%m/%d/%Y"
+DATE_COLUMNS = ['Planting_Date', 'Harvesting_Date']
+CATEGORICAL_COLUMNS = ['Municipality', 'Season', 'Rice_Ecosystem']
+NUMERIC_COLUMNS = [
+    'Hybrid_Seeds_Area_Harvested_(Ha)', 'Hybrid_Seeds_Average_Yield_(MT/Ha)', 'Hybrid_Seeds_Production_(MT)',
+    'Certified_Seeds_Area_Harvested(Ha)', 'Certified_Seeds_Average_Yield(MT/Ha)', 'Certified_Seeds_Production(MT)',
+    'Farmer_Seeds_Area_Harvested_(Ha)', 'Farmer_Seeds_Average_Yield_(MT/Ha)', 'Farmer_Seeds_Production_(MT)',
+    'Total_Area_Harvested(Ha)', 'TotalAverage_Yield(MT/Ha)', 'Total_Production(MT)',
+]
+
+# Explicit dtypes for read_csv; columns missing from a file are ignored by pandas. Numeric
+# columns are coerced after reading so that a stray token such as '-' becomes NaN.
+COLUMN_DTYPES = {column: 'category' for column in CATEGORICAL_COLUMNS}
+
+# Number of parsed datasets kept in memory
+DATASET_CACHE_SIZE = 4
+
+_dataset_cache = OrderedDict()
+_dataset_cache_lock = threading.Lock()
+
+
+def parse_dates(values):
+    # Parse with the known format first; values in any other format fall back to
+    # pandas' general parser instead of silently becoming NaT
+    parsed = pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+    unparsed = parsed.isna() & values.notna()
+    if unparsed.any():
+        parsed[unparsed] = pd.to_datetime(values[unparsed], format='mixed', errors='coerce')
+    return parsed
+
+
+def read_dataset(source):
+    # Read a dataset CSV (path or file-like object) with explicit dtypes, parse the date
+    # columns once and derive 'Year'. Municipality, Season and Rice_Ecosystem become categoricals;
+    # numeric columns become float64 with values that are not numbers as NaN.
+    with span('read_csv'):
+        df = pd.read_csv(source, dtype=COLUMN_DTYPES, encoding='utf-8-sig')
+        for column in NUMERIC_COLUMNS:
+            if column in df.columns and not pd.api.types.is_float_dtype(df[column]):
+                df[column] = pd.to_numeric(df[column], errors='coerce').astype('float64')
+    with span('parse_dates', rows=len(df)):
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = parse_dates(df[column])
+    typed_df = add_year_column(df)
+    return df if typed_df is None else typed_df
+
+
+def load_dataset(content):
+    # Parsed dataset for the raw CSV bytes, cached by content hash. The returned frame is
+    # shared between callers and must not be modified in place.
+    key = hashlib.sha256(content).hexdigest()
+    with _dataset_cache_lock:
+        if key in _dataset_cache:
+            _dataset_cache.move_to_end(key)
+            return _dataset_cache[key]
+
+    df = read_dataset(io.BytesIO(content))
+
+    with _dataset_cache_lock:
+        _dataset_cache[key] = df
+        while len(_dataset_cache) > DATASET_CACHE_SIZE:
+            _dataset_cache.popitem(last=False)
+    return df
+
+
+def load_dataset_file(path):
+    with open(path, 'rb') as f:
+        return load_dataset(f.read())
+
+
+class DataFrameSource:
+    # In-memory dataset with the same interface as dataset_store.DatasetStore, so that
+    # objective1 can pick years and municipalities before selecting any rows
+
+    def __init__(self, df):
+        typed_df = add_year_column(df)
+        self.df = df if typed_df is None else typed_df
+        self.columns = self.df.columns.tolist()
+
+    def overview(self):
+        return self.df
+
+    def year_range(self):
+        return year_range(self.df)
+
+    def _select(self, municipalities=None, start_year=None, end_year=None):
+        mask = pd.Series(True, index=self.df.index)
+        if municipalities is not None:
+            mask &= self.df['Municipality'].isin(municipalities)
+        if start_year is not None:
+            mask &= self.df['Year'] >= start_year
+        if end_year is not None:
+            mask &= self.df['Year'] <= end_year
+        return self.df[mask]
+
+    def municipalities(self, start_year=None, end_year=None):
+        return self._select(start_year=start_year, end_year=end_year)['Municipality'].unique().tolist()
+
+    def load(self, municipalities=None, start_year=None, end_year=None):
+        return self._select(municipalities, start_year, end_year)
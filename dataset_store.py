@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from urllib.parse import unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from data_loading import CATEGORICAL_COLUMNS, DATE_COLUMNS, NUMERIC_COLUMNS, read_dataset
+
+# Columnar dataset store: CSVs are ingested into Parquet files partitioned by
+# Municipality and Year, and loads read only the partitions of the selected
+# municipalities and year range.
+#
+#   python dataset_store.py ingest data/aliciasanmateodataset.csv data/smdatasets.csv
+#   python dataset_store.py info
+
+DEFAULT_STORE_DIR = "data/store"
+
+# Partition index written at ingest time; pyarrow skips files starting with "_"
+MANIFEST_FILE = "_manifest.json"
+
+PARTITION_COLUMNS = ['Municipality', 'Year']
+STORE_PARTITIONING = ds.partitioning(
+    pa.schema([('Municipality', pa.string()), ('Year', pa.int32())]), flavor='hive'
+)
+
+# Every partition uses the same schema, so ingests of files with different column sets
+# stay readable together; columns an ingest does not have are stored as nulls and are
+# listed per partition in the manifest
+DATA_COLUMNS = ['Row_ID'] + DATE_COLUMNS + [column for column in CATEGORICAL_COLUMNS if column != 'Municipality'] \
+    + NUMERIC_COLUMNS
+STORE_SCHEMA = pa.schema(
+    [('Row_ID', pa.float64())]
+    + [(column, pa.timestamp('us')) for column in DATE_COLUMNS]
+    + [(column, pa.dictionary(pa.int32(), pa.string()))
+       for column in CATEGORICAL_COLUMNS if column != 'Municipality']
+    + [(column, pa.float64()) for column in NUMERIC_COLUMNS]
+    + [('Municipality', pa.string()), ('Year', pa.int32())]
+)
+
+
+def read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"partitions": []}
+
+
+def _partition_key(relative_dir):
+    # 'Municipality=San%20Mateo/Year=2003' -> ('San Mateo', 2003)
+    values = dict(unquote(part).split('=', 1) for part in relative_dir.split('/'))
+    return values['Municipality'], int(values['Year'])
+
+
+def _stored_rows(store_dir, entries):
+    # Stored rows of the given manifest entries, with the entry's columns as '_columns'
+    files = [os.path.join(store_dir, path) for entry in entries for path in entry["files"]]
+    dataset = ds.dataset(files, schema=STORE_SCHEMA, format='parquet',
+                         partitioning=STORE_PARTITIONING, partition_base_dir=store_dir)
+    df = dataset.to_table().to_pandas()
+    columns = {(entry["municipality"], entry["year"]): tuple(entry["columns"]) for entry in entries}
+    df['_columns'] = [columns[key] for key in zip(df['Municipality'], df['Year'])]
+    return df
+
+
+def ingest(csv_paths, store_dir=DEFAULT_STORE_DIR, replace=False):
+    # Convert CSVs into the partitioned store. New rows are merged into the stored
+    # partitions they fall in, or replace them with `replace`; all other partitions are
+    # left untouched. Rows duplicated across overlapping files or already stored are kept
+    # once. A partition lists the columns that all of its rows have, so rows from files
+    # with different columns never mix present and missing values in a load.
+    # Returns the number of rows written.
+    frames = []
+    for path in csv_paths:
+        frame = read_dataset(path)
+        columns = tuple(column for column in DATA_COLUMNS if column in frame.columns)
+        frames.append(frame[list(columns) + PARTITION_COLUMNS].assign(_columns=[columns] * len(frame)))
+    df = pd.concat(frames, ignore_index=True)
+    df = df[df['Year'].notna() & df['Municipality'].notna()].astype({'Municipality': str, 'Year': 'int32'})
+
+    manifest = read_manifest(store_dir)
+    affected = set(zip(df['Municipality'], df['Year']))
+    stored = [entry for entry in manifest["partitions"] if (entry["municipality"], entry["year"]) in affected]
+    if stored and not replace:
+        # Stored rows first, so that they are the ones kept when a new row duplicates them
+        df = pd.concat([_stored_rows(store_dir, stored), df], ignore_index=True)
+
+    parts, partition_columns = [], {}
+    for key, part in df.groupby(PARTITION_COLUMNS, sort=False):
+        shared = set.intersection(*(set(columns) for columns in part['_columns'].unique()))
+        part = part.drop_duplicates(subset=[column for column in DATA_COLUMNS if column in shared and column != 'Row_ID'])
+        partition_columns[key] = [column for column in DATA_COLUMNS
+                                  if all(column in columns for columns in part['_columns'].unique())]
+        parts.append(part)
+    df = pd.concat(parts, ignore_index=True)
+
+    for column in DATA_COLUMNS:
+        if column not in df.columns:
+            df[column] = pd.NaT if column in DATE_COLUMNS else None
+    df = df[DATA_COLUMNS + PARTITION_COLUMNS]
+    for column in CATEGORICAL_COLUMNS:
+        if column != 'Municipality':
+            df[column] = df[column].astype('category')
+
+    written = []
+    pq.write_to_dataset(
+        pa.Table.from_pandas(df, schema=STORE_SCHEMA, preserve_index=False), store_dir,
+        partitioning=STORE_PARTITIONING, existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet', file_visitor=lambda written_file: written.append(written_file.path),
+    )
+
+    # Update the manifest: replace the entries of the partitions written by this ingest
+    files = {}
+    for path in written:
+        relative_path = os.path.relpath(path, store_dir).replace(os.sep, '/')
+        files.setdefault(_partition_key(os.path.dirname(relative_path)), []).append(relative_path)
+    rows = df.groupby(PARTITION_COLUMNS).size()
+
+    partitions = [entry for entry in manifest["partitions"]
+                  if (entry["municipality"], entry["year"]) not in files]
+    for (municipality, year), paths in files.items():
+        partitions.append({"municipality": municipality, "year": year, "rows": int(rows[(municipality, year)]),
+                           "columns": partition_columns[(municipality, year)], "files": sorted(paths)})
+    partitions.sort(key=lambda entry: (entry["municipality"], entry["year"]))
+
+    tmp_path = os.path.join(store_dir, f"{MANIFEST_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"partitions": partitions}, f, indent=1)
+    os.replace(tmp_path, os.path.join(store_dir, MANIFEST_FILE))
+    return len(df)
+
+
+def store_exists(store_dir=DEFAULT_STORE_DIR):
+    return os.path.exists(os.path.join(store_dir, MANIFEST_FILE))
+
+
+def store_version(store_dir=DEFAULT_STORE_DIR):
+    # Changes whenever an ingest rewrites the manifest; used to invalidate cached stores
+    try:
+        return os.stat(os.path.join(store_dir, MANIFEST_FILE)).st_mtime_ns
+    except OSError:
+        return None
+
+
+class DatasetStore:
+    # Read side of the store. The partition index comes from the manifest alone, so
+    # listing municipalities and years does not touch any data file, and loads open
+    # only the files of the selected partitions.
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        self.store_dir = store_dir
+        self.partitions = pd.DataFrame(read_manifest(store_dir)["partitions"],
+                                       columns=["municipality", "year", "rows", "columns", "files"])
+
+    @property
+    def columns(self):
+        # Data columns available in at least one partition, plus the partition columns
+        stored = {column for partition_columns in self.partitions["columns"] for column in partition_columns}
+        return [column for column in DATA_COLUMNS if column in stored] + PARTITION_COLUMNS
+
+    def overview(self):
+        return self.partitions[["municipality", "year", "rows"]]
+
+    def year_range(self):
+        return int(self.partitions["year"].min()), int(self.partitions["year"].max())
+
+    def _select(self, municipalities=None, start_year=None, end_year=None):
+        mask = pd.Series(True, index=self.partitions.index)
+        if municipalities is not None:
+            mask &= self.partitions["municipality"].isin(municipalities)
+        if start_year is not None:
+            mask &= self.partitions["year"] >= start_year
+        if end_year is not None:
+            mask &= self.partitions["year"] <= end_year
+        return self.partitions[mask]
+
+    def municipalities(self, start_year=None, end_year=None):
+        return self._select(start_year=start_year, end_year=end_year)["municipality"].unique().tolist()
+
+    def load(self, municipalities=None, start_year=None, end_year=None):
+        # Typed frame (same dtypes as data_loading.read_dataset) for the selected partitions,
+        # with the data columns available in all of them
+        selected = self._select(municipalities, start_year, end_year)
+        available = [column for column in DATA_COLUMNS
+                     if all(column in partition_columns for partition_columns in selected["columns"])]
+        # Restore the column order of the CSVs
+        leading = [column for column in available if column in ['Row_ID'] + DATE_COLUMNS]
+        columns = leading + ['Municipality'] + available[len(leading):] + ['Year']
+
+        files = [os.path.join(self.store_dir, path) for paths in selected["files"] for path in paths]
+        if not files:
+            return pd.DataFrame(columns=columns)
+
+        dataset = ds.dataset(files, schema=STORE_SCHEMA, format='parquet',
+                             partitioning=STORE_PARTITIONING, partition_base_dir=self.store_dir)
+        df = dataset.to_table(columns=columns).to_pandas()
+        df['Municipality'] = df['Municipality'].astype('category')
+        return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Partitioned Parquet store for the rice production datasets.")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help=f"Store directory (default: {DEFAULT_STORE_DIR}).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="Convert CSV files into the store.")
+    ingest_parser.add_argument("csv", nargs="+", help="CSV files to ingest together.")
+    ingest_parser.add_argument("--replace", action="store_true",
+                               help="Replace the stored partitions the files have rows for instead of merging into them.")
+    commands.add_parser("info", help="List the stored partitions.")
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        rows = ingest(args.csv, args.store, replace=args.replace)
+        print(f"Ingested {rows} rows from {len(args.csv)} file(s) into {args.store}")
+    else:
+        if not store_exists(args.store):
+            print(f"No dataset store found in {args.store}", file=sys.stderr)
+            return 1
+        overview = DatasetStore(args.store).overview()
+        print(overview.groupby("municipality").agg(years=("year", "nunique"), first=("year", "min"),
+                                                   last=("year", "max"), rows=("rows", "sum")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_sarimax import AGREEMENT_TOLERANCES, agreement_failures, agreement_report, batch_forecast
+from data_cleaning import clean_dataset
+from data_loading import read_dataset
+from instrumentation import start_recording
+from model_cache import DEFAULT_CACHE_DIR, ModelCache
+from order_search import DEFAULT_SEASONAL_PERIOD, OrderCache, search_orders
+from sarimax_core import (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER, EXOGENOUS_VARS, collect_series,
+                          default_workers, fit_diagnostics, fit_series, forecast_sarimax)
+
+# Headless batch forecasting: runs the same cleaning and SARIMAX pipeline as the dashboard
+# for every municipality of one or more CSV files, without Streamlit.
+#
+#   python forecast_cli.py data/smdatasets.csv --horizon 3 --output forecasts.parquet
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch SARIMAX forecasts for every municipality.")
+    parser.add_argument("csv", nargs="+", help="Input CSV file(s) in the dashboard's dataset format.")
+    parser.add_argument("--horizon", type=int, default=3, help="Forecast period in years (default: 3).")
+    parser.add_argument("--start-year", type=int, help="First year used for fitting (default: earliest).")
+    parser.add_argument("--end-year", type=int, help="Last year used for fitting (default: latest).")
+    parser.add_argument("--municipalities", nargs="+", help="Only forecast these municipalities.")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Number of fit processes (default: CPU count, 1 fits serially).")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Prediction interval level (default: 0.05).")
+    parser.add_argument("--output", default="forecasts.csv",
+                        help="Forecast output file, .csv or .parquet (default: forecasts.csv).")
+    parser.add_argument("--diagnostics", default="fit_diagnostics.csv",
+                        help="Fit diagnostics output file, .csv or .parquet (default: fit_diagnostics.csv).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Model cache directory shared with the dashboard (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--no-cache", action="store_true", help="Always refit from scratch.")
+    parser.add_argument("--engine", choices=["statsmodels", "batched"], default="statsmodels",
+                        help="'batched' fits all series of the same model order together in one vectorized "
+                             "Kalman filter instead of one statsmodels fit per series (default: statsmodels).")
+    parser.add_argument("--auto-order", action="store_true",
+                        help="Select (p,d,q)(P,D,Q,s) per series instead of the fixed default order.")
+    parser.add_argument("--criterion", choices=["aic", "bic"], default="aic",
+                        help="Information criterion for --auto-order (default: aic).")
+    parser.add_argument("--seasonal-period", type=int, default=DEFAULT_SEASONAL_PERIOD,
+                        help=f"Seasonal period for --auto-order (default: {DEFAULT_SEASONAL_PERIOD}).")
+    parser.add_argument("--check-agreement", action="store_true",
+                        help="With --engine batched, also fit every series with statsmodels and fail when the "
+                             "likelihoods or forecast means and variances at statsmodels' estimates differ by more "
+                             f"than {AGREEMENT_TOLERANCES['llf_diff_at_statsmodels_params']:g}, or the forecasts differ "
+                             f"from the dashboard's by more than {AGREEMENT_TOLERANCES['forecast_diff_dashboard']:.0%} "
+                             "(relative).")
+    parser.add_argument("--spans", help="Write the stage timings and per-series fit spans to this JSON file.")
+    args = parser.parse_args(argv)
+    if args.check_agreement and args.engine != "batched":
+        parser.error("--check-agreement requires --engine batched")
+    return args
+
+
+def write_table(df, path):
+    if path.endswith(".parquet"):
+        try:
+            df.to_parquet(path, index=False)
+        except ImportError:
+            sys.exit(f"Writing {path} requires pyarrow; install it or use a .csv output.")
+    else:
+        df.to_csv(path, index=False)
+
+
+def run(args):
+    timings = {}
+    recorder = start_recording()
+
+    # Stage 1: read every CSV
+    start = time.perf_counter()
+    raw = {path: read_dataset(path) for path in args.csv}
+    timings["load"] = time.perf_counter() - start
+
+    # Stage 2: clean and build one series per (file, municipality)
+    start = time.perf_counter()
+    series = {}
+    exog_columns = {}
+    for path, df in raw.items():
+        try:
+            cleaned, municipalities = clean_dataset(df, args.start_year, args.end_year, args.municipalities)
+        except ValueError as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        columns = [var for var in EXOGENOUS_VARS if var in cleaned.columns]
+        if not columns:
+            print(f"Skipping {path}: no exogenous variables found.", file=sys.stderr)
+            continue
+        for municipality, prepared in collect_series(cleaned, municipalities, columns).items():
+            series[(path, municipality)] = prepared
+        exog_columns[path] = columns
+    timings["clean"] = time.perf_counter() - start
+
+    batches = {}
+    for name, (_, production, exog_data, _) in series.items():
+        batches.setdefault(tuple(exog_columns[name[0]]), []).append((name, production, exog_data))
+
+    # Stage 3 (optional): select model orders for all series in parallel
+    orders = None
+    if args.auto_order:
+        start = time.perf_counter()
+        order_cache = None if args.no_cache else OrderCache(cache_dir=args.cache_dir)
+        selections = search_orders([item for batch in batches.values() for item in batch],
+                                   criterion=args.criterion, seasonal_period=args.seasonal_period,
+                                   max_workers=args.workers, cache=order_cache)
+        orders = {name: (selection['order'], selection['seasonal_order'])
+                  for name, selection in selections.items()}
+        timings["order search"] = time.perf_counter() - start
+
+    # Stage 4: fit all series in parallel, one batch per distinct exog column set. The batched
+    # engine forecasts as part of the fit.
+    start = time.perf_counter()
+    fits = {}
+    batch_results = {}
+    if args.engine == "batched":
+        for batch in batches.values():
+            batch_results.update(batch_forecast(batch, args.horizon, orders=orders, alpha=args.alpha))
+        fits = {name: (None, result['error'], "batched") for name, result in batch_results.items()}
+    else:
+        cache = None if args.no_cache else ModelCache(max_entries=max(len(series), 1), cache_dir=args.cache_dir)
+        for columns, batch in batches.items():
+            for name, fit_model, error, mode in fit_series(batch, list(columns), cache=cache,
+                                                           max_workers=args.workers, orders=orders):
+                fits[name] = (fit_model, error, mode)
+    timings["fit"] = time.perf_counter() - start
+
+    # Stage 4b (optional): check the batched engine against statsmodels on the same series
+    disagreements = skipped = 0
+    if args.check_agreement:
+        start = time.perf_counter()
+        for (path, municipality), (_, production, exog_data, _) in series.items():
+            order, seasonal_order = (orders or {}).get((path, municipality), (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER))
+            try:
+                report = agreement_report(production, exog_data, order, seasonal_order, steps=args.horizon)
+            except (ValueError, np.linalg.LinAlgError) as e:
+                skipped += 1
+                print(f"Agreement check failed to run for {municipality} ({os.path.basename(path)}): {e}",
+                      file=sys.stderr)
+                continue
+            failures = agreement_failures(report)
+            if failures:
+                disagreements += 1
+                print(f"Batched engine disagrees with statsmodels for {municipality} ({os.path.basename(path)}): "
+                      + ", ".join(f"{check}={report[check]:.2e}" for check in failures), file=sys.stderr)
+        timings["agreement"] = time.perf_counter() - start
+
+    # Stage 5: forecast and collect diagnostics
+    start = time.perf_counter()
+    forecast_rows = []
+    diagnostic_rows = []
+    for (path, municipality), (years, production, exog_data, _) in series.items():
+        fit_model, error, mode = fits[(path, municipality)]
+        order, seasonal_order = (orders or {}).get((path, municipality), (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER))
+        diagnostics = {"source": os.path.basename(path), "municipality": municipality,
+                       "order": str(order), "seasonal_order": str(seasonal_order),
+                       "mode": mode, "error": error}
+        forecast_years = None
+        if fit_model is not None:
+            diagnostics.update(fit_diagnostics(fit_model))
+            forecast_years, forecast_values, intervals = forecast_sarimax(
+                fit_model, years, exog_data, args.horizon, alpha=args.alpha)
+        elif error is None and (path, municipality) in batch_results:
+            result = batch_results[(path, municipality)]
+            diagnostics.update(result['diagnostics'])
+            forecast_years = np.arange(years[-1] + 1, years[-1] + args.horizon + 1)
+            forecast_values, intervals = result['forecast'], result['intervals']
+        if forecast_years is not None:
+            for step, (year, value, (lower, upper)) in enumerate(zip(forecast_years, forecast_values, intervals), 1):
+                forecast_rows.append({"source": os.path.basename(path), "municipality": municipality,
+                                      "step": step, "year": int(year), "forecast": float(value),
+                                      "lower": float(lower), "upper": float(upper)})
+        diagnostic_rows.append(diagnostics)
+    timings["forecast"] = time.perf_counter() - start
+
+    # Stage 6: write outputs
+    start = time.perf_counter()
+    write_table(pd.DataFrame(forecast_rows), args.output)
+    write_table(pd.DataFrame(diagnostic_rows), args.diagnostics)
+    timings["write"] = time.perf_counter() - start
+
+    if args.spans:
+        with open(args.spans, "w") as f:
+            json.dump(dict(recorder.to_dict(), stages=timings), f, indent=1, default=str)
+
+    total = sum(timings.values())
+    failed = sum(1 for _, error, _ in fits.values() if error is not None)
+    width = max(map(len, [*timings, 'total']))
+    for stage, seconds in timings.items():
+        print(f"{stage:>{width}}: {seconds:8.3f} s")
+    print(f"{'total':>{width}}: {total:8.3f} s")
+    print(f"{len(series)} series ({failed} failed) in {total:.3f} s "
+          f"-> {len(series) / total if total > 0 else 0:.2f} series/second")
+    if args.check_agreement:
+        print(f"Batched engine agrees with statsmodels for {len(series) - disagreements - skipped} of "
+              f"{len(series)} series ({disagreements} disagree, {skipped} could not be checked)")
+    return 1 if (series and failed == len(series)) or disagreements or skipped else 0
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,373 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from data_cleaning import clean_dataset
+from data_loading import read_dataset
+from dataset_store import DatasetStore, store_version
+from model_cache import DEFAULT_CACHE_DIR, ModelCache, make_cache_key
+from sarimax_core import (DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER, EXOGENOUS_VARS, collect_series,
+                          default_workers, fit_diagnostics, fit_series, forecast_sarimax)
+
+# HTTP/JSON service for the SARIMAX forecasts of the dashboard. Forecasts are kept in an
+# in-memory store per municipality and interval level, up to MAX_HORIZON steps, so every
+# shorter horizon is served from the same entry. A miss fits the model with the same spec
+# as the dashboard (through the shared model cache); concurrent requests for the same
+# series wait for one fit. The dataset is re-read when its file or store changes, and only
+# the forecasts of series whose data changed are dropped.
+#
+#   python forecast_service.py data/smdatasets.csv --port 8000 --precompute
+#   curl 'http://localhost:8000/forecast?municipality=SanMateo&horizon=3'
+#
+# Endpoints: /health, /municipalities, /stats and /forecast?municipality=..&horizon=..&alpha=..
+# (without municipality, the forecasts of all municipalities).
+
+DEFAULT_PORT = 8000
+DEFAULT_ALPHA = 0.05
+MAX_HORIZON = 10
+
+# Maximum number of fitted models kept in memory by the service
+MODEL_CACHE_SIZE = 256
+
+
+class ForecastError(Exception):
+    # A series whose model could not be fitted or forecast
+    pass
+
+
+class UnknownMunicipality(Exception):
+    # A municipality without a series in the current dataset
+    pass
+
+
+class InvalidRequest(ValueError):
+    # Invalid forecast arguments; other ValueErrors are not the client's fault
+    pass
+
+
+class SingleFlight:
+    # Runs at most one call per key at a time; callers arriving while a call for the same
+    # key is running wait for it and share its result (or exception)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result'] = function()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+
+def _float_values(values):
+    # Floats for JSON; undefined values become null
+    return [float(value) if np.isfinite(value) else None for value in values]
+
+
+class ForecastService:
+    # Forecast store and lazy fitting for one dataset, a CSV file or a dataset store directory
+
+    def __init__(self, csv_path=None, store_dir=None, cache_dir=DEFAULT_CACHE_DIR, max_horizon=MAX_HORIZON):
+        if (csv_path is None) == (store_dir is None):
+            raise ValueError("Give either a CSV file or a dataset store directory.")
+        self.csv_path = csv_path
+        self.store_dir = store_dir
+        self.max_horizon = max_horizon
+        self.model_cache = ModelCache(max_entries=MODEL_CACHE_SIZE, cache_dir=cache_dir)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.version = None
+        self.series = {}
+        self.keys = {}
+        self.exog_columns = []
+        self.forecasts = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.refresh()
+
+    def dataset_version(self):
+        if self.store_dir is not None:
+            return store_version(self.store_dir)
+        stat = os.stat(self.csv_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        df = DatasetStore(self.store_dir).load() if self.store_dir is not None else read_dataset(self.csv_path)
+        cleaned, municipalities = clean_dataset(df)
+        columns = [var for var in EXOGENOUS_VARS if var in cleaned.columns]
+        return collect_series(cleaned, municipalities, columns), columns
+
+    def refresh(self):
+        # Re-read the dataset if it changed since the last check. Returns True on a reload.
+        with self._refresh_lock:
+            version = self.dataset_version()
+            if version == self.version:
+                return False
+            series, columns = self._load()
+            keys = {str(municipality): make_cache_key(production, exog_data, DEFAULT_ORDER,
+                                                      DEFAULT_SEASONAL_ORDER, columns)
+                    for municipality, (_, production, exog_data, _) in series.items()}
+            with self._lock:
+                self.version = version
+                self.series = {str(municipality): prepared for municipality, prepared in series.items()}
+                self.keys = keys
+                self.exog_columns = columns
+                stale = [store_key for store_key, entry in self.forecasts.items()
+                         if keys.get(store_key[0]) != entry['key']]
+                for store_key in stale:
+                    del self.forecasts[store_key]
+                self.invalidated += len(stale)
+            return True
+
+    def municipalities(self):
+        self.refresh()
+        with self._lock:
+            return list(self.series)
+
+    def _entry(self, municipality, key, years, exog_data, fit_model, error, mode, alpha):
+        # Store entry with the forecast over max_horizon steps
+        if error is not None:
+            raise ForecastError(error)
+        forecast_years, forecast_values, intervals = forecast_sarimax(fit_model, years, exog_data,
+                                                                      self.max_horizon, alpha=alpha)
+        intervals = np.asarray(intervals)
+        entry = {
+            'key': key,
+            'years': [int(year) for year in forecast_years],
+            'forecast': _float_values(np.asarray(forecast_values)),
+            'lower': _float_values(intervals[:, 0]),
+            'upper': _float_values(intervals[:, 1]),
+            'order': list(fit_model.model.order),
+            'seasonal_order': list(fit_model.model.seasonal_order),
+            'mode': mode,
+            'diagnostics': fit_diagnostics(fit_model),
+        }
+        with self._lock:
+            # A reload during the fit may have changed the series; then the entry is not kept
+            if self.keys.get(municipality) == key:
+                self.forecasts[(municipality, alpha)] = entry
+        return entry
+
+    def _fit(self, municipality, key, alpha):
+        with self._lock:
+            years, production, exog_data, _ = self.series[municipality]
+            columns = self.exog_columns
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            _, fit_model, error, mode = next(fit_series([(municipality, production, exog_data)], columns,
+                                                        cache=self.model_cache, max_workers=1))
+            return self._entry(municipality, key, years, exog_data, fit_model, error, mode, alpha)
+
+    def precompute(self, alpha=DEFAULT_ALPHA, max_workers=None):
+        # Fit every municipality (in parallel) and fill the store; returns the failed ones
+        self.refresh()
+        with self._lock:
+            series = dict(self.series)
+            keys = dict(self.keys)
+            columns = self.exog_columns
+        failed = {}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            batch = [(municipality, production, exog_data)
+                     for municipality, (_, production, exog_data, _) in series.items()]
+            for municipality, fit_model, error, mode in fit_series(batch, columns, cache=self.model_cache,
+                                                                   max_workers=max_workers):
+                years, _, exog_data, _ = series[municipality]
+                try:
+                    self._entry(municipality, keys[municipality], years, exog_data, fit_model, error, mode, alpha)
+                except (ForecastError, ValueError, np.linalg.LinAlgError) as e:
+                    failed[municipality] = str(e)
+        return failed
+
+    def forecast(self, municipality, horizon, alpha=DEFAULT_ALPHA):
+        # Forecast of one municipality; raises UnknownMunicipality for unknown municipalities,
+        # InvalidRequest for invalid arguments and ForecastError if the model cannot be fitted
+        if not 1 <= horizon <= self.max_horizon:
+            raise InvalidRequest(f"horizon must be between 1 and {self.max_horizon}")
+        if not 0 < alpha < 1:
+            raise InvalidRequest("alpha must be between 0 and 1")
+        self.refresh()
+        with self._lock:
+            if municipality not in self.series:
+                raise UnknownMunicipality(municipality)
+            key = self.keys[municipality]
+            entry = self.forecasts.get((municipality, alpha))
+            source = 'store' if entry is not None else 'fit'
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            version = self.version
+        if entry is None:
+            try:
+                entry = self._flight.do((key, alpha), lambda: self._fit(municipality, key, alpha))
+            except (ValueError, np.linalg.LinAlgError) as e:
+                raise ForecastError(str(e))
+
+        return {
+            'municipality': municipality,
+            'horizon': horizon,
+            'alpha': alpha,
+            'order': entry['order'],
+            'seasonal_order': entry['seasonal_order'],
+            'source': source,
+            'fit_mode': entry['mode'],
+            'dataset_version': str(version),
+            'diagnostics': entry['diagnostics'],
+            'forecast': [{'step': step + 1, 'year': entry['years'][step], 'forecast': entry['forecast'][step],
+                          'lower': entry['lower'][step], 'upper': entry['upper'][step]}
+                         for step in range(horizon)],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'dataset_version': str(self.version),
+                'municipalities': len(self.series),
+                'stored_forecasts': len(self.forecasts),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self._flight.coalesced,
+                'invalidated': self.invalidated,
+                'model_cache': self.model_cache.stats(),
+            }
+
+
+def _query_number(query, name, default, parse):
+    # Query parameter parsed with `parse` (int or float)
+    try:
+        return parse(query.get(name, default))
+    except ValueError:
+        raise InvalidRequest(f"{name} must be {'an integer' if parse is int else 'a number'}") from None
+
+
+class ForecastRequestHandler(BaseHTTPRequestHandler):
+    # GET-only JSON API over the server's ForecastService
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/health":
+                self._send(200, {'status': 'ok', 'dataset_version': str(service.version)})
+            elif url.path == "/municipalities":
+                self._send(200, {'municipalities': service.municipalities()})
+            elif url.path == "/stats":
+                self._send(200, service.stats())
+            elif url.path == "/forecast":
+                horizon = _query_number(query, 'horizon', 3, int)
+                alpha = _query_number(query, 'alpha', DEFAULT_ALPHA, float)
+                if 'municipality' in query:
+                    self._send(200, service.forecast(query['municipality'], horizon, alpha))
+                else:
+                    forecasts, errors = [], {}
+                    for municipality in service.municipalities():
+                        try:
+                            forecasts.append(service.forecast(municipality, horizon, alpha))
+                        except ForecastError as e:
+                            errors[municipality] = str(e)
+                        except UnknownMunicipality:
+                            # Removed from the dataset since the list was taken
+                            continue
+                    self._send(200, {'forecasts': forecasts, 'errors': errors})
+            else:
+                self._send(404, {'error': f"Unknown path {url.path}"})
+        except UnknownMunicipality as e:
+            self._send(404, {'error': f"Unknown municipality {e.args[0]}"})
+        except InvalidRequest as e:
+            self._send(400, {'error': str(e)})
+        except (ForecastError, np.linalg.LinAlgError) as e:
+            self._send(422, {'error': str(e)})
+        except OSError as e:
+            # e.g. the dataset file was removed
+            self._send(503, {'error': str(e)})
+        except Exception as e:
+            # Anything else is a server error, still answered with JSON instead of a dropped connection
+            self.log_error("Error handling %s: %r", self.path, e)
+            self._send(500, {'error': f"Internal error: {type(e).__name__}"})
+
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), ForecastRequestHandler)
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON service for the SARIMAX forecasts.")
+    parser.add_argument("csv", nargs="?", help="Dataset CSV file (or use --store).")
+    parser.add_argument("--store", help="Serve a dataset store directory instead of a CSV file.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT}).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Model cache directory shared with the dashboard (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--max-horizon", type=int, default=MAX_HORIZON,
+                        help=f"Longest forecast horizon served (default: {MAX_HORIZON}).")
+    parser.add_argument("--precompute", action="store_true",
+                        help="Fit all municipalities before serving instead of on the first request.")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Fit processes for --precompute (default: CPU count).")
+    args = parser.parse_args(argv)
+
+    try:
+        service = ForecastService(args.csv, args.store, args.cache_dir, args.max_horizon)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.precompute:
+        failed = service.precompute(max_workers=args.workers)
+        for municipality, error in failed.items():
+            print(f"{municipality}: {error}", file=sys.stderr)
+
+    server = make_server(service, args.host, args.port)
+    print(f"Serving forecasts on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+import argparse
+import sys
+import warnings
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from data_cleaning import clean_dataset
+from data_loading import read_dataset
+from model_cache import DEFAULT_CACHE_DIR, ModelCache
+from sarimax_core import EXOGENOUS_VARS, default_workers, fit_series
+
+# Hierarchical forecasts: municipalities add up to provinces, provinces to regions (and
+# regions to a national total when there are several). Every node gets a base SARIMAX
+# forecast; the aggregate series are built from the municipality series with one product
+# with the summing matrix S, fitted once each in the same parallel, cached batch as the
+# municipalities, and the base forecasts are reconciled so that they add up:
+#
+#   bottom-up:  municipality forecasts summed up the hierarchy
+#   MinT:       S G y_hat with G = (S' W^-1 S)^-1 S' W^-1 and W the shrinkage estimate of
+#               the covariance of the one-step-ahead forecast errors of all nodes
+#
+# G is computed once and applied to all forecast steps at the same time.
+#
+#   python hierarchy.py data/aliciasanmateodataset.csv --hierarchy provinces.csv --output reconciled.csv
+
+# Used when the data has no Province or Region column and no mapping is given
+DEFAULT_PROVINCE = "Province"
+DEFAULT_REGION = "Region"
+
+# Exogenous columns that add up over municipalities; the others (codes such as Season)
+# are averaged
+ADDITIVE_COLUMNS = ['Certified_Seeds_Area_Harvested(Ha)', 'Hybrid_Seeds_Area_Harvested_(Ha)',
+                    'Total_Area_Harvested(Ha)']
+
+METHODS = ['base', 'bottom_up', 'mint']
+
+# Fitted models kept in memory by the command line tool
+MODEL_CACHE_SIZE = 1024
+
+
+def hierarchy_table(df, mapping=None):
+    # Province and region of every municipality: from the data's Province/Region columns,
+    # else from `mapping` (a frame with Municipality, Province and Region columns), else the defaults
+    table = pd.DataFrame({'Municipality': df['Municipality'].astype(str).unique()})
+    for level, default in (('Province', DEFAULT_PROVINCE), ('Region', DEFAULT_REGION)):
+        if level in df.columns:
+            values = df.assign(Municipality=df['Municipality'].astype(str)).groupby('Municipality')[level].first()
+        elif mapping is not None and level in mapping.columns:
+            values = mapping.assign(Municipality=mapping['Municipality'].astype(str)).set_index('Municipality')[level]
+        else:
+            values = pd.Series(dtype=object)
+        table[level] = table['Municipality'].map(values).fillna(default).astype(str)
+    return table
+
+
+def bottom_series(df, exog_columns):
+    # Production (T, m) and exogenous values (m, T, k) of the municipalities on their common
+    # (Year, Season) periods; rows of the same municipality and period are combined first
+    # (the exogenous values are made numeric as in sarimax_core.prepare_series, so raw
+    # Season and Rice_Ecosystem labels become 0)
+    keys = ['Year', 'Season'] if 'Season' in df.columns else ['Year']
+    df = df.assign(Municipality=df['Municipality'].astype(str), **{
+        column: pd.to_numeric(df[column], errors='coerce').fillna(0) for column in exog_columns if column not in keys
+    })
+    aggregations = {'Total_Production(MT)': 'sum'}
+    aggregations.update({column: 'sum' if column in ADDITIVE_COLUMNS else 'mean'
+                         for column in exog_columns if column not in keys})
+    grouped = df.groupby(['Municipality'] + keys, observed=True).agg(aggregations)
+    wide = grouped.unstack('Municipality').dropna()
+    municipalities = wide['Total_Production(MT)'].columns.tolist()
+    production = wide['Total_Production(MT)'].to_numpy(dtype=float)
+    periods = wide.index.to_frame(index=False)
+    exog = np.stack([pd.to_numeric(periods[column], errors='coerce').fillna(0).to_numpy(dtype=float)[:, None]
+                     .repeat(len(municipalities), axis=1)
+                     if column in keys else wide[column][municipalities].to_numpy(dtype=float)
+                     for column in exog_columns], axis=-1).transpose(1, 0, 2)
+    return municipalities, periods, production, exog
+
+
+def summing_matrix(table):
+    # Nodes (level, name), top level first, and S (nodes, municipalities) with S[i, j] = 1
+    # when municipality j belongs to node i; the municipalities are the last rows
+    levels = ['Region', 'Province']
+    if table['Region'].nunique() > 1:
+        table = table.assign(Total='Total')
+        levels = ['Total'] + levels
+    nodes, rows = [], []
+    for level in levels:
+        codes, names = pd.factorize(table[level])
+        nodes.extend((level, name) for name in names)
+        rows.append(np.eye(len(names))[codes].T)
+    nodes.extend(('Municipality', name) for name in table['Municipality'])
+    rows.append(np.eye(len(table)))
+    return nodes, np.vstack(rows)
+
+
+def shrinkage_covariance(residuals):
+    # Covariance of the columns of `residuals` (T, n) shrunk towards its diagonal with the
+    # Schafer-Strimmer intensity, as in MinT(shrink); always positive definite for
+    # non-constant residuals, also when there are more series than observations
+    T = len(residuals)
+    sample = residuals.T @ residuals / T
+    sd = np.sqrt(np.diag(sample))
+    standardized = residuals / sd
+    products = standardized[:, :, None] * standardized[:, None, :]
+    correlation = products.mean(axis=0)
+    variance = products.var(axis=0) * T ** 2 / (T - 1) ** 3 if T > 1 else np.zeros_like(correlation)
+    off_diagonal = ~np.eye(len(sample), dtype=bool)
+    denominator = np.sum(correlation[off_diagonal] ** 2)
+    intensity = float(np.clip(np.sum(variance[off_diagonal]) / denominator, 0, 1)) if denominator > 0 else 1.0
+    shrunk = (1 - intensity) * sample
+    shrunk[np.diag_indices_from(shrunk)] = np.diag(sample)
+    return shrunk, intensity
+
+
+def reconciliation_matrix(S, W):
+    # MinT: G such that S G y_hat are the reconciled forecasts
+    weighted = np.linalg.solve(W, S)
+    return np.linalg.solve(S.T @ weighted, weighted.T)
+
+
+def reconcile(S, G, means, sds, correlation):
+    # Reconciled means (n, steps) and standard deviations, with the base forecast errors at
+    # each step assumed to have the base standard deviations and the residual correlation
+    P = S @ G
+    reconciled = P @ means
+    covariance = sds.T[:, :, None] * correlation[None] * sds.T[:, None, :]
+    variance = np.einsum('ij,hjk,ik->ih', P, covariance, P)
+    return reconciled, np.sqrt(np.clip(variance, 0, None))
+
+
+def hierarchical_forecast(df, steps, municipalities=None, mapping=None, alpha=0.05, cache=None, max_workers=None):
+    # Base, bottom-up and MinT forecasts of every node. Returns (frame, info): one row per
+    # node and step with the forecasts and intervals of each method, and a dict with the
+    # nodes, the failed fits, the shrinkage intensity and notes on unavailable methods.
+    if municipalities is not None:
+        df = df[df['Municipality'].isin(municipalities)]
+    exog_columns = [var for var in EXOGENOUS_VARS if var in df.columns]
+    names, periods, production, exog = bottom_series(df, exog_columns)
+    if not names:
+        raise ValueError("The municipalities have no common periods.")
+    table = hierarchy_table(df, mapping).set_index('Municipality').loc[names].reset_index()
+    nodes, S = summing_matrix(table)
+    n_nodes, n_bottom = S.shape
+
+    # All aggregate series with one product; averaged columns are divided by the counts
+    node_production = production @ S.T
+    counts = S.sum(axis=1)
+    node_exog = np.einsum('nm,mtk->ntk', S, exog)
+    for k, column in enumerate(exog_columns):
+        if column not in ADDITIVE_COLUMNS:
+            node_exog[:, :, k] /= counts[:, None]
+
+    # Nodes with the same municipalities (e.g. a region with a single province) share one
+    # series, so each distinct series is fitted and reconciled once
+    unique_rows, first, inverse = np.unique(S, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    U = unique_rows[order]
+    series_of_node = np.argsort(order)[inverse.ravel()]
+    representatives = first[order]
+    bottom = series_of_node[n_nodes - n_bottom:]
+
+    batch = [(nodes[i], node_production[:, i], node_exog[i]) for i in representatives]
+    position = {nodes[i]: u for u, i in enumerate(representatives)}
+    means = np.full((len(U), steps), np.nan)
+    sds = np.full((len(U), steps), np.nan)
+    residuals = {}
+    errors = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for node, fit_model, error, _ in fit_series(batch, exog_columns, cache=cache, max_workers=max_workers):
+            u = position[node]
+            if error is not None:
+                errors[node] = error
+                continue
+            future_exog = np.tile(node_exog[representatives[u], -1], (steps, 1))
+            prediction = fit_model.get_forecast(steps=steps, exog=future_exog)
+            means[u] = np.asarray(prediction.predicted_mean)
+            sds[u] = np.sqrt(np.asarray(prediction.var_pred_mean))
+            residuals[u] = fit_model.forecasts_error[0, fit_model.loglikelihood_burn:]
+
+    available = np.array(sorted(residuals), dtype=int)
+    notes = {}
+    results = {'base': (means, sds)}
+    intensity = None
+    if len(available):
+        # One-step errors of all series over the periods after the longest burn-in
+        length = min(len(residuals[u]) for u in available)
+        W, intensity = shrinkage_covariance(np.column_stack([residuals[u][-length:] for u in available]))
+        sd = np.sqrt(np.diag(W))
+        correlation = W / np.outer(sd, sd)
+
+        if np.isin(bottom, available).all():
+            selected = np.searchsorted(available, bottom)
+            results['bottom_up'] = reconcile(U, np.eye(n_bottom), means[bottom], sds[bottom],
+                                             correlation[np.ix_(selected, selected)])
+        else:
+            notes['bottom_up'] = "not available: a municipality model failed"
+        try:
+            G = reconciliation_matrix(U[available], W)
+            results['mint'] = reconcile(U, G, means[available], sds[available], correlation)
+        except np.linalg.LinAlgError:
+            notes['mint'] = "not available: the forecast error covariance is singular"
+
+    years = periods['Year'].to_numpy()
+    forecast_years = np.arange(years[-1] + 1, years[-1] + steps + 1)
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+    rows = []
+    for i, (level, name) in enumerate(nodes):
+        for step in range(steps):
+            row = {'level': level, 'node': name, 'step': step + 1, 'year': int(forecast_years[step])}
+            for method in METHODS:
+                if method in results:
+                    mean, sd = results[method][0][series_of_node[i], step], results[method][1][series_of_node[i], step]
+                    row.update({method: mean, f'{method}_lower': mean - z * sd, f'{method}_upper': mean + z * sd})
+            rows.append(row)
+    info = {'nodes': nodes, 'errors': errors, 'shrinkage': intensity, 'notes': notes,
+            'periods': len(periods), 'municipalities': n_bottom, 'fitted_series': len(U)}
+    return pd.DataFrame(rows), info
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconciled SARIMAX forecasts for municipalities, provinces and regions.")
+    parser.add_argument("csv", help="Input CSV file in the dashboard's dataset format.")
+    parser.add_argument("--hierarchy", help="CSV with Municipality, Province and Region columns "
+                                            "(default: the data's own columns, else one province and region).")
+    parser.add_argument("--horizon", type=int, default=3, help="Forecast steps (default: 3).")
+    parser.add_argument("--municipalities", nargs="+", help="Only use these municipalities.")
+    parser.add_argument("--alpha", type=float, default=0.05, help="Prediction interval level (default: 0.05).")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="Number of fit processes (default: CPU count, 1 fits serially).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Model cache directory shared with the dashboard (default: {DEFAULT_CACHE_DIR}).")
+    parser.add_argument("--no-cache", action="store_true", help="Always refit from scratch.")
+    parser.add_argument("--output", default="reconciled_forecasts.csv",
+                        help="Output CSV (default: reconciled_forecasts.csv).")
+    args = parser.parse_args(argv)
+
+    try:
+        cleaned, _ = clean_dataset(read_dataset(args.csv), municipalities=args.municipalities)
+        mapping = pd.read_csv(args.hierarchy) if args.hierarchy else None
+        cache = None if args.no_cache else ModelCache(max_entries=MODEL_CACHE_SIZE, cache_dir=args.cache_dir)
+        forecasts, info = hierarchical_forecast(cleaned, args.horizon, mapping=mapping, alpha=args.alpha,
+                                                cache=cache, max_workers=args.workers)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    forecasts.to_csv(args.output, index=False)
+
+    for node, error in info['errors'].items():
+        print(f"{node[0]} {node[1]}: {error}", file=sys.stderr)
+    for method, note in info['notes'].items():
+        print(f"{method}: {note}", file=sys.stderr)
+    print(f"{len(info['nodes'])} nodes ({info['municipalities']} municipalities, {info['periods']} common periods), "
+          f"{info['fitted_series']} distinct series fitted, {len(info['errors'])} failed; written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import contextvars
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+# Named timing spans for the processing stages. Library code calls span() and record()
+# unconditionally; they only cost anything while a recorder is active in the current
+# context, e.g. one dashboard rerun or one CLI run.
+
+# Number of functions listed in a cProfile capture
+PROFILE_LINES = 40
+
+_active_recorder = contextvars.ContextVar('active_recorder', default=None)
+
+
+class SpanRecorder:
+    # Completed spans as dicts with id, parent id, name, start (seconds since the recorder
+    # was created), duration in seconds and free-form attributes
+
+    def __init__(self):
+        self.started = time.time()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_id = 0
+        self.spans = []
+
+    def _new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add(self, span_id, parent, name, start, seconds, attributes):
+        entry = {'id': span_id, 'parent': parent, 'name': name, 'start': round(start - self._origin, 6),
+                 'seconds': round(seconds, 6), 'attributes': attributes}
+        with self._lock:
+            self.spans.append(entry)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # Time the enclosed block. The attributes dict is yielded, so values that are only
+        # known at the end (e.g. optimizer iterations) can be added inside the block.
+        stack = self._stack()
+        span_id = self._new_id()
+        parent = stack[-1] if stack else None
+        stack.append(span_id)
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            stack.pop()
+            self._add(span_id, parent, name, start, time.perf_counter() - start, attributes)
+
+    def record(self, name, seconds, **attributes):
+        # Add a span that was timed elsewhere (e.g. in a worker process) and just ended
+        stack = self._stack()
+        self._add(self._new_id(), stack[-1] if stack else None, name, time.perf_counter() - seconds, seconds,
+                  attributes)
+
+    def elapsed(self):
+        return time.perf_counter() - self._origin
+
+    def totals(self):
+        # {name: {'count', 'seconds'}} summed over all spans of each name
+        totals = {}
+        for entry in self.spans:
+            total = totals.setdefault(entry['name'], {'count': 0, 'seconds': 0.0})
+            total['count'] += 1
+            total['seconds'] += entry['seconds']
+        return totals
+
+    def to_dict(self):
+        return {'started': self.started, 'elapsed': round(self.elapsed(), 6),
+                'spans': sorted(self.spans, key=lambda entry: entry['start'])}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), default=str, **kwargs)
+
+
+def start_recording():
+    # Make a new recorder active for the rest of the current context (e.g. a Streamlit rerun)
+    recorder = SpanRecorder()
+    _active_recorder.set(recorder)
+    return recorder
+
+
+def active_recorder():
+    return _active_recorder.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    recorder = _active_recorder.get()
+    if recorder is None:
+        yield attributes
+        return
+    with recorder.span(name, **attributes) as span_attributes:
+        yield span_attributes
+
+
+def record(name, seconds, **attributes):
+    recorder = _active_recorder.get()
+    if recorder is not None:
+        recorder.record(name, seconds, **attributes)
+
+
+def start_profile():
+    # cProfile capture of the calling thread; work done in worker processes is not included
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler):
+    # Stop a capture and return the top functions by cumulative time as text
+    profiler.disable()
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return stream.getvalue()
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+# Default location for persisted model parameters (relative to the app directory)
+DEFAULT_CACHE_DIR = ".model_cache"
+
+# File that maps each series identity to the key of its most recent fit
+SERIES_INDEX_FILE = "series_index.json"
+
+# Parameter files kept on disk; beyond this the oldest are removed, the most recent fit
+# of each series last
+DEFAULT_MAX_DISK_ENTRIES = 512
+
+
+def fingerprint(arrays, spec):
+    # Hash of the values and shapes of numeric arrays together with a repr-able spec
+    hasher = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        hasher.update(str(array.shape).encode())
+        hasher.update(array.tobytes())
+    hasher.update(repr(spec).encode())
+    return hasher.hexdigest()
+
+
+def make_cache_key(production, exog_data, order, seasonal_order, exog_columns):
+    # Fingerprint the series values together with the full model specification so that
+    # any change in the data or in the SARIMAX spec produces a different key
+    return fingerprint((production, exog_data), (tuple(order), tuple(seasonal_order), tuple(exog_columns)))
+
+
+def make_series_id(name, order, seasonal_order, exog_columns):
+    # Identity of a series independent of its values, used to find the previous fit
+    # of the same municipality and spec after new rows are appended
+    return repr((name, tuple(order), tuple(seasonal_order), tuple(exog_columns)))
+
+
+class ModelCache:
+    # Bounded LRU cache of fitted SARIMAX results with optional on-disk persistence of
+    # the fitted parameters (at most max_disk_entries files). A disk hit rebuilds the
+    # results by running the Kalman smoother at the stored parameters, which is much
+    # cheaper than a full MLE fit.
+
+    def __init__(self, max_entries=64, cache_dir=None, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._series_index = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._series_index = self._read_series_index()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _params_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _read_series_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, SERIES_INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_atomic(self, path, write):
+        # Write to a temporary file first so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def _restore(self, key, model=None):
+        # Rebuild results from persisted parameters; without a model the stored
+        # series data and spec are used to reconstruct it
+        if not self.cache_dir or not os.path.exists(self._params_path(key)):
+            return None
+        try:
+            with np.load(self._params_path(key)) as stored:
+                params = stored["params"]
+                if model is None:
+                    exog = stored["exog"] if "exog" in stored.files else None
+                    model = SARIMAX(stored["endog"], exog=exog,
+                                    order=tuple(stored["order"]),
+                                    seasonal_order=tuple(stored["seasonal_order"]))
+            return model.smooth(params)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def get(self, key, model=None):
+        # Look up fitted results by key; `model` is the unfitted SARIMAX model for the
+        # same data and saves reconstructing it when restoring from disk
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        results = self._restore(key, model)
+        if results is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._store(key, results)
+            return results
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def latest(self, series_id):
+        # Most recent fit recorded for a series identity, or None. Lookups here do not
+        # count towards the hit/miss statistics.
+        key = self._series_index.get(series_id)
+        if key is None:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+        results = self._restore(key)
+        if results is not None:
+            self._store(key, results)
+        return results
+
+    def put(self, key, results, series_id=None):
+        self._store(key, results)
+        if series_id is not None:
+            with self._lock:
+                self._series_index[series_id] = key
+
+        if self.cache_dir:
+            model = results.model
+            arrays = {
+                "params": np.asarray(results.params, dtype=float),
+                "endog": np.asarray(model.endog, dtype=float)[:, 0],
+                "order": np.asarray(model.order),
+                "seasonal_order": np.asarray(model.seasonal_order),
+            }
+            if model.exog is not None:
+                arrays["exog"] = np.asarray(model.exog, dtype=float)
+            self._write_atomic(self._params_path(key), lambda f: np.savez(f, **arrays))
+            if self._prune_disk() or series_id is not None:
+                with self._lock:
+                    index = json.dumps(self._series_index).encode()
+                self._write_atomic(os.path.join(self.cache_dir, SERIES_INDEX_FILE),
+                                   lambda f: f.write(index))
+
+    def _prune_disk(self):
+        # Remove the oldest parameter files beyond max_disk_entries, keeping the most recent
+        # fit of each series as long as possible. Returns True if the series index changed.
+        entries = []
+        try:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".npz"):
+                    entries.append((entry.stat().st_mtime, entry.name[:-len(".npz")], entry.path))
+        except OSError:
+            # Files removed concurrently by another process; prune on a later put
+            return False
+        excess = len(entries) - self.max_disk_entries
+        if excess <= 0:
+            return False
+
+        with self._lock:
+            latest = set(self._series_index.values())
+        entries.sort(key=lambda entry: (entry[1] in latest, entry[0]))
+        removed = set()
+        for _, key, path in entries[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed.add(key)
+        with self._lock:
+            self.disk_evictions += len(removed)
+            stale = [series_id for series_id, key in self._series_index.items() if key in removed]
+            for series_id in stale:
+                del self._series_index[series_id]
+        return bool(stale)
+
+    def _store(self, key, results):
+        with self._lock:
+            self._entries[key] = results
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+            }
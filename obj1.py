@@ -1,56 +1,60 @@
 import pandas as pd
 import streamlit as st
 
-def objective1(df):
+from data_cleaning import encode_categoricals, filter_municipalities
+from data_loading import DataFrameSource
+from instrumentation import span
+
+def objective1(dataset):
     # Data Cleaning & Variable Identification
+    # `dataset` is a DataFrame or a dataset_store.DatasetStore; rows are only read once
+    # the year range and municipalities are selected
     
     st.sidebar.markdown("### Data Cleaning and Variable Identification")
     st.sidebar.markdown("##### Add Columns, Filter, and Clean the Dataset")
-    
-    if st.sidebar.checkbox("Show Dataset"):
-        st.write(df)
 
-    # Convert 'Planting_Date' and 'Harvesting_Date' to datetime format
-    if 'Planting_Date' in df.columns:
-        df["Planting_Date"] = pd.to_datetime(df["Planting_Date"], errors='coerce')
-    if 'Harvesting_Date' in df.columns:
-        df["Harvesting_Date"] = pd.to_datetime(df["Harvesting_Date"], errors='coerce')
+    # Convert the date columns to datetime and create 'Year' from them if possible
+    if isinstance(dataset, pd.DataFrame):
+        dataset = DataFrameSource(dataset)
+    
+    show_dataset = st.sidebar.checkbox("Show Dataset")
+    # Stores and streamed uploads also have an index of their rows per municipality and year
+    show_index = not isinstance(dataset, DataFrameSource) and st.sidebar.checkbox(
+        "Show Dataset Index", help="Number of rows per municipality and year."
+    )
+    if show_index:
+        st.write(dataset.overview())
 
-    # Create 'Year' column from 'Planting_Date' or 'Harvesting_Date' if possible
-    if 'Planting_Date' in df.columns:
-        df['Year'] = df['Planting_Date'].dt.year
-    elif 'Harvesting_Date' in df.columns:
-        df['Year'] = df['Harvesting_Date'].dt.year
-    else:
+    if 'Year' not in dataset.columns:
+        if show_dataset:
+            st.write(dataset.load())
         st.error("No valid date columns found in the dataset. Please check your data.")
         return None, [], None, None
 
     # Determine the year range from the dataset
-    min_year = int(df['Year'].min())
-    max_year = int(df['Year'].max())
+    min_year, max_year = dataset.year_range()
 
     # Sidebar year selection constrained to the dataset's year range
     st.sidebar.markdown("##### Select Year Range for Forecasting")
     start_year = st.sidebar.selectbox("Start Year", options=range(min_year, max_year + 1), index=0)
     end_year = st.sidebar.selectbox("End Year", options=range(min_year, max_year + 1), index=(max_year - min_year))
 
-    # Filter the dataset based on selected year range
-    date_filtered_df = df[(df['Year'] >= start_year) & (df['Year'] <= end_year)]
+    # Rows of the selected year range (the whole dataset by default)
+    if show_dataset:
+        st.write(dataset.load(start_year=start_year, end_year=end_year))
 
     # Automatically check the box if columns exist
-    auto_check_categorical = 'Season' in date_filtered_df.columns or 'Rice_Ecosystem' in date_filtered_df.columns
+    auto_check_categorical = 'Season' in dataset.columns or 'Rice_Ecosystem' in dataset.columns
 
     # Checkbox to convert categorical values
-    if st.sidebar.checkbox("Convert 'Season' and 'Rice Ecosystem' to numeric", value=auto_check_categorical):
-        if 'Season' in date_filtered_df.columns:
-            date_filtered_df['Season'] = date_filtered_df['Season'].replace({'Dry': 1, 'Wet': 2}).astype(float)
-        
-        if 'Rice_Ecosystem' in date_filtered_df.columns:
-            date_filtered_df['Rice_Ecosystem'] = date_filtered_df['Rice_Ecosystem'].replace({'Rainfed': 1, 'Irrigated': 2}).astype(float)
+    convert_categorical = st.sidebar.checkbox("Convert 'Season' and 'Rice Ecosystem' to numeric", value=auto_check_categorical)
+
+    filtered_df, selected_municipalities = None, []
 
     # Multi-select for filtering by 'Municipality' with a tooltip
-    if 'Municipality' in date_filtered_df.columns:
-        municipalities = date_filtered_df['Municipality'].unique().tolist()
+    if 'Municipality' in dataset.columns:
+        # Municipalities with data in the selected year range
+        municipalities = dataset.municipalities(start_year, end_year)
         st.sidebar.markdown("Choose one or more municipalities to analyze.")
         selected_municipalities = st.sidebar.multiselect(
             "Select Municipalities to Filter", municipalities, default=municipalities[:2], 
@@ -60,11 +64,15 @@ def objective1(df):
         if len(selected_municipalities) == 0:
             st.warning("Please select at least one municipality.")
         else:
-            # Filter the dataframe based on selected municipalities
-            filtered_df = date_filtered_df[date_filtered_df['Municipality'].isin(selected_municipalities)]
-            
-            # Drop rows with missing or infinite values
-            filtered_df = filtered_df.replace([float('inf'), -float('inf')], float('nan')).dropna()
+            # Read only the selected municipalities and years
+            with span('select_rows'):
+                date_filtered_df = dataset.load(selected_municipalities, start_year, end_year)
+            with span('clean', rows=len(date_filtered_df)):
+                if convert_categorical:
+                    date_filtered_df = encode_categoricals(date_filtered_df)
+
+                # Drop rows with missing or infinite values
+                filtered_df = filter_municipalities(date_filtered_df, selected_municipalities)
 
             # Show filtered data if selected
             st.sidebar.markdown("Show a preview of the filtered data below.")
@@ -1,8 +1,108 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from charts import forecast_figure, scenario_figure, small_multiples_figure
+from instrumentation import span
+from model_cache import DEFAULT_CACHE_DIR, ModelCache
+from order_search import DEFAULT_SEASONAL_PERIOD, OrderCache, search_orders
+from scenarios import PRESET_SCENARIOS, scenario_forecasts, wet_season_share
+from sarimax_core import (DEFAULT_DRIFT_THRESHOLD, DEFAULT_MAX_APPEND, EXOGENOUS_VARS, collect_series,
+                          default_workers, fit_series, forecast_sarimax)
+
+# Maximum number of fitted models kept in memory across Streamlit reruns
+MODEL_CACHE_SIZE = 128
+
+# Maximum number of figures kept across reruns
+FIGURE_CACHE_SIZE = 256
+
+# The automatic chart layout switches to small multiples above this many municipalities
+SMALL_MULTIPLES_THRESHOLD = 6
+
+@st.cache_resource
+def get_model_cache():
+    # A single cache instance shared by all reruns and sessions of the app
+    return ModelCache(max_entries=MODEL_CACHE_SIZE, cache_dir=DEFAULT_CACHE_DIR)
+
+@st.cache_resource
+def get_order_cache():
+    return OrderCache(cache_dir=DEFAULT_CACHE_DIR)
+
+@st.cache_data(show_spinner=False, max_entries=FIGURE_CACHE_SIZE)
+def cached_forecast_figure(municipality, years, production, forecast_years, forecast_values):
+    # Cached by the plotted data, so reruns with unchanged forecasts skip building the figure
+    return forecast_figure(municipality, years, production, forecast_years, forecast_values)
+
+@st.cache_data(show_spinner=False, max_entries=FIGURE_CACHE_SIZE)
+def cached_small_multiples_figure(panels):
+    return small_multiples_figure(panels)
+
+def trend(start, end):
+    return "increasing" if end > start else "decreasing" if end < start else "stable"
+
+def render_forecast(municipality, years, production, forecast_years, forecast_values, forecast_years_sarimax,
+                    model_note):
+    st.caption(f"Model: {model_note}")
+    st.plotly_chart(cached_forecast_figure(municipality, years, production, forecast_years, forecast_values))
+    
+    # Interpretation
+    historical_trend = trend(production[0], production[-1])
+    forecast_trend = trend(production[-1], forecast_values[-1])
+    avg_growth_rate = (forecast_values[-1] - production[-1]) / forecast_years_sarimax if forecast_years_sarimax > 0 else 0
+
+    st.markdown(f"""
+        **Dynamic Interpretation for {municipality}:**
+        - **Historical Trend:** The historical production trend from {years[0]} to {years[-1]} has been **{historical_trend}**.
+        - **Forecast Trend:** The forecasted production over the next {forecast_years_sarimax} year(s) is expected to be **{forecast_trend}**.
+        - **Growth Rate:** The average annual change in production is approximately **{avg_growth_rate:.2f} MT/year**.
+        - **Key Insight:** If the forecast trend continues, by {forecast_years[-1]}, production is projected to reach **{forecast_values[-1]:.2f} MT**, which could impact planning for resource allocation and agricultural strategies.
+    """)
+
+def render_small_multiples(panels, model_notes, forecast_years_sarimax):
+    # One faceted figure for all municipalities and the interpretation as a table
+    st.plotly_chart(cached_small_multiples_figure(panels))
+    st.dataframe(pd.DataFrame([
+        {'Municipality': municipality, 'Model': model_notes[municipality],
+         'Historical Trend': f"{trend(production[0], production[-1])} ({years[0]}-{years[-1]})",
+         'Forecast Trend': trend(production[-1], forecast_values[-1]),
+         'Growth Rate (MT/year)': round(float(forecast_values[-1] - production[-1]) / forecast_years_sarimax, 2),
+         f'Forecast {forecast_years[-1]} (MT)': round(float(forecast_values[-1]), 2)}
+        for municipality, years, production, forecast_years, forecast_values in panels
+    ]), hide_index=True)
+
+def scenario_settings():
+    # Sidebar inputs of the scenario comparison: {name: {column: (operation, value)}}
+    presets = st.sidebar.multiselect("Scenarios:", list(PRESET_SCENARIOS), default=list(PRESET_SCENARIOS)[:2])
+    scenarios = {name: PRESET_SCENARIOS[name] for name in presets}
+
+    st.sidebar.markdown("Custom scenario")
+    custom = {}
+    for column, label in [('Hybrid_Seeds_Area_Harvested_(Ha)', "Hybrid seed area change (%)"),
+                          ('Certified_Seeds_Area_Harvested(Ha)', "Certified seed area change (%)"),
+                          ('Total_Area_Harvested(Ha)', "Total area change (%)")]:
+        change = st.sidebar.slider(label, min_value=-50, max_value=50, value=0, step=5)
+        if change:
+            custom[column] = ('scale', 1 + change / 100)
+    if st.sidebar.checkbox("Set Wet season share", value=False):
+        custom['Season'] = wet_season_share(st.sidebar.slider("Wet season share:", 0.0, 1.0, 0.5, step=0.1))
+    if custom:
+        scenarios['Custom'] = custom
+    return scenarios
+
+def render_scenarios(municipality, years, production, fit_model, exog_data, exog_columns, scenarios, steps):
+    # All scenarios from the one fitted model, compared on one chart and in a table
+    st.markdown("<h3 style='text-align: center; color: white;'>Scenario Forecasts</h3>", unsafe_allow_html=True)
+    names, means, intervals = scenario_forecasts(fit_model, exog_data, exog_columns, scenarios, steps)
+    forecast_years = np.arange(years[-1] + 1, years[-1] + steps + 1)
+    st.plotly_chart(scenario_figure(municipality, years, production, forecast_years, names, means, intervals))
+    st.dataframe(pd.DataFrame([
+        {'Scenario': name, f'Forecast {forecast_years[-1]} (MT)': round(float(means[i, -1]), 2),
+         'Change vs Baseline (%)': round(float(means[i, -1] / means[0, -1] - 1) * 100, 2) if means[0, -1] else None,
+         '95% Interval (MT)': f"{intervals[i, -1, 0]:.2f} to {intervals[i, -1, 1]:.2f}"}
+        for i, name in enumerate(names)
+    ]), hide_index=True)
+    st.caption("Scenarios change the exogenous variables over the forecast period; the interval width "
+               "does not depend on them.")
 
 def objective3_sarimax(df, selected_municipalities, start_year, end_year):
     st.markdown("<h2 style='text-align: center; color: white;'>SARIMAX Forecast</h2>", unsafe_allow_html=True)
@@ -13,105 +113,147 @@ def objective3_sarimax(df, selected_municipalities, start_year, end_year):
         "Forecast period (years):", min_value=1, max_value=5, value=3, step=1,
         help="Choose the forecast period for production."
     )
+    max_workers = default_workers()
+    fit_workers = st.sidebar.slider(
+        "Parallel fit workers:", min_value=1, max_value=max(max_workers, 2), value=max_workers, step=1,
+        help="Number of processes used to fit municipality models. Use 1 to fit serially."
+    )
+    incremental = st.sidebar.checkbox(
+        "Incremental updates when new seasons are added", value=True,
+        help="Reuse the previous fit of a municipality: a few appended rows are absorbed by a "
+             "Kalman filter update, otherwise the model is refit starting from the previous parameters."
+    )
+    max_append, drift_threshold = DEFAULT_MAX_APPEND, DEFAULT_DRIFT_THRESHOLD
+    if incremental:
+        max_append = st.sidebar.number_input(
+            "Max appended rows for a filter update:", min_value=1, max_value=52, value=DEFAULT_MAX_APPEND,
+            help="More appended rows than this always trigger a (warm-started) refit."
+        )
+        drift_threshold = st.sidebar.number_input(
+            "Drift threshold:", min_value=0.5, max_value=10.0, value=DEFAULT_DRIFT_THRESHOLD, step=0.5,
+            help="Refit when the RMS of the standardized forecast errors of the new rows exceeds this value."
+        )
+
+    chart_layout = st.sidebar.selectbox(
+        "Chart layout:", options=["Automatic", "Per municipality", "Small multiples"],
+        help="'Small multiples' shows all forecasts in one faceted chart with a summary table. "
+             f"'Automatic' uses it when more than {SMALL_MULTIPLES_THRESHOLD} municipalities are selected."
+    )
+    small_multiples = chart_layout == "Small multiples" or (
+        chart_layout == "Automatic" and len(selected_municipalities) > SMALL_MULTIPLES_THRESHOLD)
+
+    scenario_municipality, scenarios = None, {}
+    if st.sidebar.checkbox(
+            "Scenario analysis", value=False,
+            help="Compare forecasts under changed exogenous variables, computed from the fitted "
+                 "model without refitting."):
+        scenario_municipality = st.sidebar.selectbox("Scenario municipality:", options=selected_municipalities)
+        scenarios = scenario_settings()
+
+    auto_order = st.sidebar.checkbox(
+        "Automatic order selection", value=False,
+        help="Search (p,d,q)(P,D,Q,s) per municipality by information criterion instead of "
+             "using the fixed (1,1,1)(1,1,1,12) model. Results are cached until the data changes."
+    )
+    if auto_order:
+        criterion = st.sidebar.selectbox("Selection criterion:", options=["aic", "bic"],
+                                         format_func=str.upper)
+        seasonal_period = st.sidebar.number_input(
+            "Seasonal period:", min_value=1, max_value=12, value=DEFAULT_SEASONAL_PERIOD,
+            help="Number of observations per seasonal cycle (2 for Dry/Wet seasons)."
+        )
 
     # Filter the dataframe based on the selected year range
     df = df[(df['Year'] >= start_year) & (df['Year'] <= end_year)]
 
     # Define exogenous variables to include in the model
-    exogenous_vars = ['Season', 'Rice_Ecosystem', 'Certified_Seeds_Area_Harvested(Ha)', 
-                      'Hybrid_Seeds_Area_Harvested_(Ha)', 'Total_Area_Harvested(Ha)']
-    exogenous_vars_present = [var for var in exogenous_vars if var in df.columns]
+    exogenous_vars_present = [var for var in EXOGENOUS_VARS if var in df.columns]
 
     if not exogenous_vars_present:
         st.error("No exogenous variables found in the dataset. Check your data.")
         return
 
+    model_cache = get_model_cache()
+    series = collect_series(df, selected_municipalities, exogenous_vars_present)
+    series_batch = [(municipality, production, exog_data)
+                    for municipality, (_, production, exog_data, _) in series.items()]
+
+    # Select the model order per municipality (cached by data fingerprint)
+    orders, order_notes = None, {}
+    if auto_order:
+        with st.spinner("Selecting model orders..."), span('order_search'):
+            selections = search_orders(series_batch, criterion=criterion, seasonal_period=seasonal_period,
+                                       max_workers=fit_workers, cache=get_order_cache())
+        orders = {name: (selection['order'], selection['seasonal_order'])
+                  for name, selection in selections.items()}
+        order_notes = {name: f" selected by {criterion.upper()} ({selection['evaluated']} candidates evaluated)"
+                       for name, selection in selections.items()}
+
+    # Fit every municipality with data; cache misses are fitted in parallel and results
+    # are yielded in the selection order
+    fit_results = fit_series(
+        series_batch, exogenous_vars_present, cache=model_cache, max_workers=fit_workers,
+        incremental=incremental, max_append=max_append, drift_threshold=drift_threshold, orders=orders
+    )
+    fitted = {}
+    update_counts = {'append': 0, 'warm': 0}
+    panels, model_notes = [], {}
+    scenario_inputs = None
+
+    # Render charts in the original order as fits complete
     for municipality in selected_municipalities:
-        muni_df = df[df['Municipality'] == municipality]
-        
-        if muni_df.empty:
+        if municipality not in series:
             st.warning(f"No data available for {municipality} in the chosen date range.")
             continue
 
-        # Extract production data and exogenous variables
-        years = muni_df['Year'].values
-        production = muni_df['Total_Production(MT)'].values
-
-        # Ensure exog data is numeric and handle missing values
-        exog_data = muni_df[exogenous_vars_present].copy()
-        exog_data = exog_data.apply(pd.to_numeric, errors='coerce').fillna(0).values  # Convert to numeric and fill NaNs
-        
-        # Check for non-numeric entries and convert them to zero
-        if np.isnan(exog_data).any() or np.isinf(exog_data).any():
+        years, production, exog_data, replaced_invalid = series[municipality]
+        if replaced_invalid:
             st.warning(f"Non-numeric or infinite values in exogenous variables for {municipality} were replaced with zero.")
-            exog_data = np.nan_to_num(exog_data, nan=0.0, posinf=0.0, neginf=0.0)
-
-        # Fit the SARIMAX model
-        try:
-            model = SARIMAX(production, exog=exog_data, order=(1, 1, 1), seasonal_order=(1, 1, 1, 12))
-            fit_model = model.fit(disp=False)
-        except ValueError as e:
-            st.error(f"Error fitting SARIMAX model for {municipality}: {e}")
+
+        while municipality not in fitted:
+            name, fit_model, error, mode = next(fit_results)
+            fitted[name] = (fit_model, error)
+            if mode in update_counts:
+                update_counts[mode] += 1
+
+        fit_model, error = fitted.pop(municipality)
+        if error is not None:
+            st.error(f"Error fitting SARIMAX model for {municipality}: {error}")
             continue
 
-        # Forecast for future years
-        future_exog = np.tile(exog_data[-1, :], (forecast_years_sarimax, 1))
-        forecast_years = np.arange(years[-1] + 1, years[-1] + forecast_years_sarimax + 1)
-        forecast_values = fit_model.forecast(steps=forecast_years_sarimax, exog=future_exog)
-
-        # Combine data for smooth lines
-        full_years = np.concatenate((years, forecast_years))
-        full_production = np.concatenate((production, forecast_values))
-        residual_years = np.concatenate(([years[-1]], forecast_years))
-        residual_values = np.concatenate(([production[-1]], forecast_values))
-
-        # Visualization
-        fig = go.Figure()
-
-        # Historical data (blue)
-        fig.add_trace(go.Scatter(
-            x=years, y=production,
-            mode='lines', name='Historical Production',
-            line=dict(color='blue'),
-            hovertemplate='Year: %{x}<br>Historical Production: %{y:.2f} MT'
-        ))
-
-        # Residual data (green)
-        fig.add_trace(go.Scatter(
-            x=residual_years, y=residual_values,
-            mode='lines', name='Residual Production',
-            line=dict(color='green'),
-            hovertemplate='Year: %{x}<br>Residual Production: %{y:.2f} MT'
-        ))
-
-        # Forecasted data (red)
-        fig.add_trace(go.Scatter(
-            x=forecast_years, y=forecast_values,
-            mode='lines', name='Forecasted Production',
-            line=dict(color='red'),
-            hovertemplate='Year: %{x}<br>Forecasted Production: %{y:.2f} MT'
-        ))
-
-        # Layout
-        fig.update_layout(
-            title=f"SARIMAX Forecast for {municipality}",
-            xaxis_title="Year",
-            yaxis_title="Total Production (MT)",
-            legend_title="Data",
-            hovermode="x unified",
-            template="plotly_dark"
+        with span('forecast', series=str(municipality)):
+            forecast_years, forecast_values, _ = forecast_sarimax(fit_model, years, exog_data, forecast_years_sarimax)
+        if municipality == scenario_municipality:
+            scenario_inputs = (years, production, fit_model, exog_data)
+        model_note = (f"SARIMAX{fit_model.model.order}x{fit_model.model.seasonal_order}"
+                      f"{order_notes.get(municipality, '')}")
+        if small_multiples:
+            panels.append((municipality, years, production, forecast_years, forecast_values))
+            model_notes[municipality] = model_note
+            continue
+        with span('render_forecast', series=str(municipality)):
+            render_forecast(municipality, years, production, forecast_years, forecast_values, forecast_years_sarimax,
+                            model_note)
+
+    if panels:
+        with span('render_small_multiples', series=len(panels)):
+            render_small_multiples(panels, model_notes, forecast_years_sarimax)
+
+    if scenario_inputs is not None:
+        with span('scenarios', series=str(scenario_municipality), scenarios=len(scenarios)):
+            render_scenarios(scenario_municipality, *scenario_inputs, exogenous_vars_present, scenarios,
+                             forecast_years_sarimax)
+
+    # Show cache effectiveness in the sidebar
+    cache_stats = model_cache.stats()
+    st.sidebar.markdown("##### Model Cache")
+    st.sidebar.caption(
+        f"Hits: {cache_stats['hits']} (disk: {cache_stats['disk_hits']}) | "
+        f"Misses: {cache_stats['misses']} | "
+        f"Entries: {cache_stats['entries']}/{cache_stats['max_entries']}"
+    )
+    if incremental:
+        st.sidebar.caption(
+            f"Incremental: {update_counts['append']} filter update(s), "
+            f"{update_counts['warm']} warm-started refit(s)"
         )
-        st.plotly_chart(fig)
-        
-        # Interpretation
-        historical_trend = "increasing" if production[-1] > production[0] else "decreasing" if production[-1] < production[0] else "stable"
-        forecast_trend = "increasing" if forecast_values[-1] > production[-1] else "decreasing" if forecast_values[-1] < production[-1] else "stable"
-        avg_growth_rate = (forecast_values[-1] - production[-1]) / forecast_years_sarimax if forecast_years_sarimax > 0 else 0
-
-        st.markdown(f"""
-            **Dynamic Interpretation for {municipality}:**
-            - **Historical Trend:** The historical production trend from {years[0]} to {years[-1]} has been **{historical_trend}**.
-            - **Forecast Trend:** The forecasted production over the next {forecast_years_sarimax} year(s) is expected to be **{forecast_trend}**.
-            - **Growth Rate:** The average annual change in production is approximately **{avg_growth_rate:.2f} MT/year**.
-            - **Key Insight:** If the forecast trend continues, by {forecast_years[-1]}, production is projected to reach **{forecast_values[-1]:.2f} MT**, which could impact planning for resource allocation and agricultural strategies.
-        """)
@@ -0,0 +1,105 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+from backtest import DEFAULT_FOLDS, DEFAULT_HORIZON, backtest_report, backtest_series
+from instrumentation import span
+from sarimax_core import DEFAULT_ORDER, DEFAULT_SEASONAL_ORDER, EXOGENOUS_VARS, collect_series, default_workers
+
+@st.cache_data(show_spinner=False)
+def run_backtest(series_batch, horizon, n_folds, window, max_workers):
+    # Cached by the series data and settings, so reruns of the app do not refit any fold
+    return backtest_series(series_batch, horizon, n_folds, window=window, max_workers=max_workers)
+
+def render_backtest(municipality, production, result):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=np.arange(len(production)), y=production,
+        mode='lines', name='Actual Production',
+        line=dict(color='blue'),
+        hovertemplate='Observation: %{x}<br>Actual Production: %{y:.2f} MT'
+    ))
+    for fold in result['folds']:
+        if fold['error'] is not None:
+            continue
+        steps = np.arange(fold['origin'], fold['origin'] + len(fold['forecast']))
+        fig.add_trace(go.Scatter(
+            x=np.concatenate((steps, steps[::-1])),
+            y=np.concatenate((fold['upper'], fold['lower'][::-1])).astype(float),
+            fill='toself', fillcolor='rgba(255, 0, 0, 0.1)', line=dict(width=0),
+            hoverinfo='skip', showlegend=False
+        ))
+        fig.add_trace(go.Scatter(
+            x=steps, y=fold['forecast'],
+            mode='lines+markers', name=f"Forecast from observation {fold['origin']}",
+            line=dict(color='red'),
+            hovertemplate='Observation: %{x}<br>Forecasted Production: %{y:.2f} MT'
+        ))
+    fig.update_layout(
+        title=f"Backtest Forecasts for {municipality}",
+        xaxis_title="Observation",
+        yaxis_title="Total Production (MT)",
+        showlegend=False,
+        hovermode="x unified",
+        template="plotly_dark"
+    )
+    st.plotly_chart(fig)
+
+def objective5_backtest(df, selected_municipalities, start_year, end_year):
+    st.sidebar.title("Backtesting")
+    run = st.sidebar.checkbox(
+        "Run rolling-origin backtest", value=False,
+        help="Refit the SARIMAX model at several past forecast origins and compare its forecasts "
+             "with what actually happened."
+    )
+    if not run:
+        return
+
+    horizon = st.sidebar.slider("Backtest horizon (observations):", min_value=1, max_value=6,
+                                value=DEFAULT_HORIZON, step=1)
+    n_folds = st.sidebar.slider("Number of folds:", min_value=2, max_value=20, value=DEFAULT_FOLDS, step=1)
+    rolling = st.sidebar.checkbox(
+        "Rolling window", value=False,
+        help="Train each fold on a fixed number of recent observations instead of all earlier ones."
+    )
+    window = st.sidebar.number_input("Window length (observations):", min_value=12, max_value=500,
+                                     value=24) if rolling else None
+
+    st.markdown("<h2 style='text-align: center; color: white;'>Forecast Backtest</h2>", unsafe_allow_html=True)
+    st.write(f"Rolling-origin evaluation of SARIMAX{DEFAULT_ORDER}x{DEFAULT_SEASONAL_ORDER} forecasts")
+
+    df = df[(df['Year'] >= start_year) & (df['Year'] <= end_year)]
+    exogenous_vars_present = [var for var in EXOGENOUS_VARS if var in df.columns]
+    if not exogenous_vars_present:
+        st.error("No exogenous variables found in the dataset. Check your data.")
+        return
+
+    series = collect_series(df, selected_municipalities, exogenous_vars_present)
+    series_batch = [(municipality, production, exog_data)
+                    for municipality, (_, production, exog_data, _) in series.items()]
+    with st.spinner("Running backtest folds..."), span('backtest', series=len(series_batch)):
+        results = run_backtest(series_batch, horizon, n_folds, window, default_workers())
+
+    # Accuracy summary per municipality
+    summary = pd.DataFrame([
+        {'Municipality': municipality, 'Folds': result['metrics']['folds'], 'Failed': result['metrics']['failed'],
+         'MAPE (%)': result['metrics']['mape'], 'RMSE (MT)': result['metrics']['rmse'],
+         'Interval Coverage': result['metrics']['coverage']}
+        for municipality, result in results.items()
+    ])
+    st.dataframe(summary, hide_index=True)
+    st.caption("Interval coverage is the share of actual values inside the 95% prediction intervals.")
+
+    for municipality, result in results.items():
+        if not result['metrics']['folds']:
+            st.warning(f"Not enough data to backtest {municipality} with these settings.")
+            continue
+        render_backtest(municipality, series[municipality][1], result)
+
+    report = backtest_report(results, horizon=horizon, folds=n_folds, window=window,
+                             order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER)
+    st.download_button("Download backtest report (JSON)", data=json.dumps(report, indent=1),
+                       file_name="backtest.json", mime="application/json")
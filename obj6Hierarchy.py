@@ -0,0 +1,85 @@
+import plotly.graph_objects as go
+import streamlit as st
+
+from hierarchy import hierarchical_forecast
+from instrumentation import span
+from sarimax_core import default_workers
+
+METHOD_LABELS = {'mint': "MinT (shrinkage)", 'bottom_up': "Bottom-up", 'base': "Base (unreconciled)"}
+
+@st.cache_data(show_spinner=False)
+def run_hierarchy(df, selected_municipalities, steps, max_workers):
+    # Cached by the data and settings, so reruns of the app do not refit any level
+    return hierarchical_forecast(df, steps, municipalities=selected_municipalities, max_workers=max_workers)
+
+def render_node(forecasts, level, node):
+    # Base and reconciled forecasts of one node with the MinT prediction interval
+    rows = forecasts[(forecasts['level'] == level) & (forecasts['node'] == node)]
+    fig = go.Figure()
+    if 'mint' in rows.columns:
+        fig.add_trace(go.Scatter(
+            x=list(rows['year']) + list(rows['year'])[::-1],
+            y=list(rows['mint_upper']) + list(rows['mint_lower'])[::-1],
+            fill='toself', fillcolor='rgba(255, 0, 0, 0.1)', line=dict(width=0),
+            hoverinfo='skip', showlegend=False
+        ))
+    for method, color in (('base', 'gray'), ('bottom_up', 'green'), ('mint', 'red')):
+        if method in rows.columns:
+            fig.add_trace(go.Scatter(
+                x=rows['year'], y=rows[method],
+                mode='lines+markers', name=METHOD_LABELS[method],
+                line=dict(color=color),
+                hovertemplate=f'Year: %{{x}}<br>{METHOD_LABELS[method]}: %{{y:.2f}} MT'
+            ))
+    fig.update_layout(
+        title=f"Reconciled Forecasts for {level} {node}",
+        xaxis_title="Year",
+        yaxis_title="Total Production (MT)",
+        legend_title="Method",
+        hovermode="x unified",
+        template="plotly_dark"
+    )
+    st.plotly_chart(fig)
+
+def objective6_hierarchy(df, selected_municipalities, start_year, end_year):
+    st.sidebar.title("Hierarchical Forecast")
+    run = st.sidebar.checkbox(
+        "Run hierarchical forecast", value=False,
+        help="Forecast the municipalities and their province and region totals, and reconcile the "
+             "forecasts so that they add up."
+    )
+    if not run:
+        return
+
+    steps = st.sidebar.slider("Hierarchy forecast period:", min_value=1, max_value=5, value=3, step=1)
+    method = st.sidebar.selectbox("Reconciliation:", options=list(METHOD_LABELS), format_func=METHOD_LABELS.get)
+
+    st.markdown("<h2 style='text-align: center; color: white;'>Hierarchical Forecast</h2>", unsafe_allow_html=True)
+    st.write("Municipality, province and region forecasts reconciled bottom-up and with MinT")
+
+    df = df[(df['Year'] >= start_year) & (df['Year'] <= end_year)]
+    with st.spinner("Fitting all levels of the hierarchy..."), span('hierarchy', series=len(selected_municipalities)):
+        try:
+            forecasts, info = run_hierarchy(df, list(selected_municipalities), steps, default_workers())
+        except (ValueError, TypeError) as e:
+            st.error(f"Hierarchical forecast not available: {e}")
+            return
+
+    for (level, node), error in info['errors'].items():
+        st.warning(f"Error fitting SARIMAX model for {level} {node}: {error}")
+    if method not in forecasts.columns:
+        st.warning(f"{METHOD_LABELS[method]} reconciliation is {info['notes'].get(method, 'not available')}.")
+        return
+    st.caption(f"{info['municipalities']} municipalities over {info['periods']} common seasons; "
+               f"{info['fitted_series']} distinct series fitted"
+               + (f"; shrinkage intensity {info['shrinkage']:.2f}" if info['shrinkage'] is not None else ""))
+
+    aggregates = [(level, node) for level, node in info['nodes'] if level != 'Municipality']
+    for level, node in aggregates:
+        render_node(forecasts, level, node)
+
+    table = forecasts[['level', 'node', 'year', method, f'{method}_lower', f'{method}_upper']]
+    st.dataframe(table.rename(columns={method: 'Forecast (MT)', f'{method}_lower': 'Lower (MT)',
+                                       f'{method}_upper': 'Upper (MT)'}), hide_index=True)
+    st.download_button("Download reconciled forecasts (CSV)", data=forecasts.to_csv(index=False),
+                       file_name="reconciled_forecasts.csv", mime="text/csv")
@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import warnings
+
+import numpy as np
+from statsmodels.tsa.stattools import kpss
+
+from model_cache import fingerprint
+from sarimax_core import build_model, make_executor
+
+# The data has one Dry and one Wet season per year, so the natural seasonal period is 2
+DEFAULT_SEASONAL_PERIOD = 2
+DEFAULT_MAX_ORDER = 2           # upper bound for p and q
+DEFAULT_MAX_SEASONAL_ORDER = 1  # upper bound for P and Q
+DEFAULT_CRITERION = 'aic'
+
+# Candidate fits use a capped number of optimizer iterations; a candidate that has not
+# converged by then is discarded instead of being refined further
+CANDIDATE_MAXITER = 50
+
+# Upper bound on the number of candidates evaluated for one series
+MAX_CANDIDATES = 40
+
+ORDER_CACHE_FILE = "orders.json"
+
+
+def select_differencing(production, seasonal_period):
+    # Pick d with a KPSS stationarity test and D by comparing the variance of the series
+    # with and without a seasonal difference. Information criteria are only comparable
+    # between models with the same differencing, so d and D are fixed before the search.
+    production = np.asarray(production, dtype=float)
+    d = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            if kpss(production, regression='c', nlags='auto')[1] < 0.05:
+                d = 1
+        except (ValueError, OverflowError):
+            pass
+
+    differenced = np.diff(production, n=d) if d else production
+    D = 0
+    if seasonal_period > 1 and len(differenced) > 2 * seasonal_period:
+        seasonal_differenced = differenced[seasonal_period:] - differenced[:-seasonal_period]
+        if np.var(seasonal_differenced) < np.var(differenced):
+            D = 1
+    return d, D
+
+
+def _evaluate_candidate(production, exog_data, order, seasonal_order, criterion):
+    # Worker entry point: returns (criterion value, converged); failures count as +inf
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            results = build_model(production, exog_data, order, seasonal_order).fit(
+                disp=False, maxiter=CANDIDATE_MAXITER)
+        except (ValueError, np.linalg.LinAlgError):
+            return np.inf, False
+    value = float(getattr(results, criterion))
+    converged = bool(results.mle_retvals.get('converged', False)) and np.isfinite(value)
+    return value, converged
+
+
+def _neighbours(candidate, max_order, max_seasonal_order):
+    # Candidates with exactly one more AR/MA or seasonal AR/MA term
+    p, q, P, Q = candidate
+    bounds = (max_order, max_order, max_seasonal_order, max_seasonal_order)
+    for i in range(4):
+        if candidate[i] < bounds[i]:
+            yield tuple(value + 1 if j == i else value for j, value in enumerate(candidate))
+
+
+def _to_orders(candidate, d, D, seasonal_period):
+    p, q, P, Q = candidate
+    if seasonal_period <= 1:
+        P = Q = D = 0
+    return (p, d, q), (P, D, Q, seasonal_period if seasonal_period > 1 else 0)
+
+
+def search_orders(series, criterion=DEFAULT_CRITERION, seasonal_period=DEFAULT_SEASONAL_PERIOD,
+                  max_order=DEFAULT_MAX_ORDER, max_seasonal_order=DEFAULT_MAX_SEASONAL_ORDER,
+                  max_workers=None, cache=None):
+    # Select (order, seasonal_order) for each (name, production, exog_data) in `series` by
+    # the given information criterion. The search starts from the model without ARMA terms
+    # and proceeds in rounds of increasing complexity; every round evaluates the candidates
+    # of all series concurrently. Only converged candidates that improve on the candidate
+    # they were derived from are expanded, so non-converging and dominated branches are
+    # pruned. Returns {name: {'order', 'seasonal_order', 'criterion', 'value', 'evaluated'}}.
+    if seasonal_period <= 1:
+        # Non-seasonal models have no P and Q; expanding them would refit the same model
+        max_seasonal_order = 0
+    search_spec = ('order-search', criterion, seasonal_period, max_order, max_seasonal_order, CANDIDATE_MAXITER)
+    selected = {}
+    states = {}
+    for name, production, exog_data in series:
+        key = fingerprint((production, exog_data), search_spec)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            selected[name] = cached
+            continue
+        d, D = select_differencing(production, seasonal_period)
+        states[name] = {
+            'key': key, 'production': production, 'exog_data': exog_data, 'd': d, 'D': D,
+            'frontier': [((0, 0, 0, 0), np.inf)], 'visited': set(), 'best': None, 'best_value': np.inf,
+        }
+
+    executor = make_executor(max_workers, max(len(states), 1) * 4) if states else None
+    try:
+        while any(state['frontier'] for state in states.values()):
+            # Submit the frontier of every series as one round
+            round_tasks = []
+            for name, state in states.items():
+                for candidate, parent_value in state['frontier']:
+                    state['visited'].add(candidate)
+                    order, seasonal_order = _to_orders(candidate, state['d'], state['D'], seasonal_period)
+                    args = (state['production'], state['exog_data'], order, seasonal_order, criterion)
+                    if executor is None:
+                        outcome = _evaluate_candidate(*args)
+                    else:
+                        outcome = executor.submit(_evaluate_candidate, *args)
+                    round_tasks.append((name, candidate, parent_value, outcome))
+                state['frontier'] = []
+
+            for name, candidate, parent_value, outcome in round_tasks:
+                state = states[name]
+                try:
+                    value, converged = outcome if executor is None else outcome.result()
+                except Exception:
+                    value, converged = np.inf, False
+                if not converged:
+                    continue
+                if value < state['best_value']:
+                    state['best'], state['best_value'] = candidate, value
+                if value < parent_value:
+                    for neighbour in _neighbours(candidate, max_order, max_seasonal_order):
+                        queued = [queued_candidate for queued_candidate, _ in state['frontier']]
+                        if (neighbour not in state['visited'] and neighbour not in queued and
+                                len(state['visited']) + len(state['frontier']) < MAX_CANDIDATES):
+                            state['frontier'].append((neighbour, value))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    for name, state in states.items():
+        # Fall back to the plain differenced regression if no candidate converged
+        best = state['best'] or (0, 0, 0, 0)
+        order, seasonal_order = _to_orders(best, state['d'], state['D'], seasonal_period)
+        selected[name] = {
+            'order': order,
+            'seasonal_order': seasonal_order,
+            'criterion': criterion,
+            'value': state['best_value'] if np.isfinite(state['best_value']) else None,
+            'evaluated': len(state['visited']),
+        }
+        if cache is not None:
+            cache.put(state['key'], selected[name])
+    return selected
+
+
+class OrderCache:
+    # Selected orders keyed by a fingerprint of the series data and the search settings,
+    # optionally persisted as JSON so a re-search only happens when the data changes
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._entries = {}
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                with open(self._path()) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def _path(self):
+        return os.path.join(self.cache_dir, ORDER_CACHE_FILE)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        # JSON turns tuples into lists
+        return dict(entry, order=tuple(entry['order']), seasonal_order=tuple(entry['seasonal_order']))
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            if self.cache_dir:
+                tmp_path = f"{self._path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self._path())
@@ -0,0 +1,235 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.statespace.sarimax import SARIMAX
+
+from instrumentation import record, span
+from model_cache import make_cache_key, make_series_id
+
+# Exogenous variables used by the SARIMAX model (only those present in the data are used)
+EXOGENOUS_VARS = ['Season', 'Rice_Ecosystem', 'Certified_Seeds_Area_Harvested(Ha)',
+                  'Hybrid_Seeds_Area_Harvested_(Ha)', 'Total_Area_Harvested(Ha)']
+
+DEFAULT_ORDER = (1, 1, 1)
+DEFAULT_SEASONAL_ORDER = (1, 1, 1, 12)
+
+# Incremental updates: at most this many appended rows are absorbed by a Kalman filter
+# update, and only while the RMS of their standardized one-step-ahead forecast errors
+# stays below the drift threshold (the errors are N(0, 1) when the model still fits)
+DEFAULT_MAX_APPEND = 8
+DEFAULT_DRIFT_THRESHOLD = 2.5
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def prepare_series(muni_df, exog_columns):
+    # Extract production data and exogenous variables for one municipality
+    years = muni_df['Year'].values
+    production = muni_df['Total_Production(MT)'].values
+
+    # Ensure exog data is numeric and handle missing values
+    exog_data = muni_df[exog_columns].apply(pd.to_numeric, errors='coerce').fillna(0).values
+
+    # Replace any remaining non-numeric or infinite entries with zero
+    replaced_invalid = bool(np.isnan(exog_data).any() or np.isinf(exog_data).any())
+    if replaced_invalid:
+        exog_data = np.nan_to_num(exog_data, nan=0.0, posinf=0.0, neginf=0.0)
+
+    return years, production, exog_data, replaced_invalid
+
+
+def collect_series(df, municipalities, exog_columns):
+    # Prepared series for every municipality with data, keyed by municipality
+    series = {}
+    for municipality, muni_df in df[df['Municipality'].isin(municipalities)].groupby('Municipality', sort=False, observed=True):
+        series[municipality] = prepare_series(muni_df, exog_columns)
+    return series
+
+
+def build_model(production, exog_data, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER):
+    return SARIMAX(production, exog=exog_data, order=order, seasonal_order=seasonal_order)
+
+
+def fit_sarimax(production, exog_data, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER,
+                start_params=None):
+    # Pure fit step: no Streamlit calls, so it can run in a worker process
+    model = build_model(production, exog_data, order, seasonal_order)
+    if start_params is not None and len(start_params) != len(model.start_params):
+        # Previous parameters belong to a different parameterization; start cold
+        start_params = None
+    return model.fit(start_params=start_params, disp=False)
+
+
+def appended_rows(previous_results, production, exog_data):
+    # Return the rows added after the data of a previous fit, or None when the new data
+    # does not simply extend the old data (edited history, fewer rows, ...)
+    previous_endog = previous_results.model.endog[:, 0]
+    previous_exog = previous_results.model.exog
+    n_previous = len(previous_endog)
+
+    if len(production) <= n_previous or previous_exog is None:
+        return None
+    if not (np.array_equal(production[:n_previous], previous_endog) and
+            np.array_equal(exog_data[:n_previous], previous_exog)):
+        return None
+    return production[n_previous:], exog_data[n_previous:]
+
+
+def append_update(previous_results, new_production, new_exog):
+    # Extend a fitted model with new observations by running the Kalman filter over them
+    # at the existing parameters (no MLE), and measure how surprising they were
+    updated = previous_results.append(new_production, exog=new_exog)
+    n_new = len(new_production)
+    errors = updated.forecasts_error[0, -n_new:]
+    variances = updated.forecasts_error_cov[0, 0, -n_new:]
+    drift = float(np.sqrt(np.mean(errors ** 2 / variances)))
+    return updated, drift
+
+
+def try_append_update(previous_results, production, exog_data, max_append=DEFAULT_MAX_APPEND,
+                      drift_threshold=DEFAULT_DRIFT_THRESHOLD):
+    # Filter-update a previous fit when the data only gained a few rows and the new rows
+    # pass the drift check; returns None when a full refit is needed instead
+    new_rows = appended_rows(previous_results, production, exog_data)
+    if new_rows is None or len(new_rows[0]) > max_append:
+        return None
+    try:
+        updated, drift = append_update(previous_results, *new_rows)
+    except ValueError:
+        return None
+    return updated if drift <= drift_threshold else None
+
+
+def _fit_task(production, exog_data, order, seasonal_order, start_params=None):
+    # Worker entry point; a failed fit is returned as an error message so it stays
+    # isolated to its own series instead of aborting the whole batch. Also returns the
+    # time spent in the worker, which the parent process records as a span.
+    start = time.perf_counter()
+    try:
+        return fit_sarimax(production, exog_data, order, seasonal_order, start_params), None, \
+            time.perf_counter() - start
+    except ValueError as e:
+        return None, str(e), time.perf_counter() - start
+
+
+def make_executor(max_workers, n_tasks):
+    # Process pool sized for `n_tasks`, or None when the work should run serially
+    if max_workers is None:
+        max_workers = default_workers()
+    max_workers = min(max_workers, n_tasks)
+    if max_workers <= 1:
+        return None
+    try:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    except (OSError, NotImplementedError):
+        # Process pools are unavailable on some platforms; fall back to serial execution
+        return None
+
+
+def fit_many(tasks, max_workers=None):
+    # Fit several series and yield (name, results, error, seconds) in the order of `tasks`
+    # as soon as each result is available. `tasks` is a list of
+    # (name, production, exog_data, order, seasonal_order[, start_params]) tuples.
+    executor = make_executor(max_workers, len(tasks))
+    if executor is None:
+        for name, *args in tasks:
+            yield (name, *_fit_task(*args))
+        return
+
+    with executor:
+        futures = [(name, executor.submit(_fit_task, *args)) for name, *args in tasks]
+        for name, future in futures:
+            try:
+                results, error, seconds = future.result()
+            except Exception as e:
+                # e.g. a worker process died; only this series is reported as failed
+                results, error, seconds = None, str(e), None
+            yield name, results, error, seconds
+
+
+def fit_series(series, exog_columns, order=DEFAULT_ORDER, seasonal_order=DEFAULT_SEASONAL_ORDER,
+               cache=None, max_workers=None, incremental=True, max_append=DEFAULT_MAX_APPEND,
+               drift_threshold=DEFAULT_DRIFT_THRESHOLD, orders=None):
+    # Fit a batch of series, yielding (name, results, error, mode) in the order of `series`,
+    # a list of (name, production, exog_data) tuples with unique names. `orders` optionally
+    # maps names to their own (order, seasonal_order). Cached fits and filter updates are
+    # resolved up front; only the remaining fits go to the worker pool.
+    # mode is one of 'cached', 'append', 'warm' or 'cold'.
+    fitted = {}
+    pending = {}
+    tasks = []
+    for name, production, exog_data in series:
+        series_order, series_seasonal_order = (orders or {}).get(name, (order, seasonal_order))
+        cache_key = series_id = previous = None
+        if cache is not None:
+            with span('model_cache', series=str(name)) as attributes:
+                cache_key = make_cache_key(production, exog_data, series_order, series_seasonal_order, exog_columns)
+                series_id = make_series_id(name, series_order, series_seasonal_order, exog_columns)
+                try:
+                    fit_model = cache.get(cache_key, build_model(production, exog_data, series_order,
+                                                                 series_seasonal_order))
+                except ValueError:
+                    # Let the fit step report the error for this series
+                    fit_model = None
+                if fit_model is not None:
+                    fitted[name] = (fit_model, None, 'cached')
+                    attributes['outcome'] = 'hit'
+                    continue
+
+                # Cache miss: try to update the previous fit of this series instead of refitting cold
+                previous = cache.latest(series_id) if incremental else None
+                if previous is not None:
+                    fit_model = try_append_update(previous, production, exog_data, max_append, drift_threshold)
+                    if fit_model is not None:
+                        cache.put(cache_key, fit_model, series_id)
+                        fitted[name] = (fit_model, None, 'append')
+                        attributes['outcome'] = 'append'
+                        continue
+                attributes['outcome'] = 'miss'
+
+        start_params = previous.params if previous is not None else None
+        pending[name] = (cache_key, series_id, 'cold' if previous is None else 'warm')
+        tasks.append((name, production, exog_data, series_order, series_seasonal_order, start_params))
+
+    # Pool results arrive in task order, which follows the order of `series`
+    fit_results = fit_many(tasks, max_workers=max_workers)
+    for name, _, _ in series:
+        if name in fitted:
+            yield (name, *fitted.pop(name))
+            continue
+
+        _, fit_model, error, seconds = next(fit_results)
+        cache_key, series_id, mode = pending.pop(name)
+        diagnostics = fit_diagnostics(fit_model) if fit_model is not None else {}
+        record('fit', seconds or 0.0, series=str(name), mode=mode, error=error,
+               iterations=diagnostics.get('iterations'), converged=diagnostics.get('converged'))
+        if fit_model is not None and cache is not None:
+            cache.put(cache_key, fit_model, series_id)
+        yield name, fit_model, error, mode
+
+
+def forecast_sarimax(fit_model, years, exog_data, steps, alpha=0.05):
+    # Forecast `steps` years ahead assuming the exogenous variables keep their last values.
+    # Returns the forecast years, point forecasts and (steps, 2) prediction intervals.
+    future_exog = np.tile(exog_data[-1, :], (steps, 1))
+    forecast_years = np.arange(years[-1] + 1, years[-1] + steps + 1)
+    prediction = fit_model.get_forecast(steps=steps, exog=future_exog)
+    return forecast_years, prediction.predicted_mean, prediction.conf_int(alpha=alpha)
+
+
+def fit_diagnostics(fit_model):
+    # Summary statistics of a fit; filter-updated results carry no optimizer output
+    mle_retvals = getattr(fit_model, 'mle_retvals', None) or {}
+    return {
+        'nobs': int(fit_model.nobs),
+        'aic': float(fit_model.aic),
+        'bic': float(fit_model.bic),
+        'llf': float(fit_model.llf),
+        'converged': mle_retvals.get('converged'),
+        'iterations': mle_retvals.get('iterations'),
+    }
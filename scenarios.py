@@ -0,0 +1,93 @@
+from statistics import NormalDist
+
+import numpy as np
+
+# What-if forecasts for exogenous scenarios from one fitted SARIMAX model. The regression
+# part of the model is linear in the exogenous variables and the forecast variance does
+# not depend on them, so every scenario's forecast is the baseline forecast shifted by
+# (X_scenario - X_baseline) @ beta with the baseline's intervals around it. All scenarios
+# come from a single get_forecast call and one matrix product, without refitting.
+
+# Built-in scenarios: {name: {column: (operation, value)}}; operations are 'scale'
+# (multiply), 'shift' (add) and 'set' (replace) applied to the baseline future values
+PRESET_SCENARIOS = {
+    'Hybrid seed area +10%': {'Hybrid_Seeds_Area_Harvested_(Ha)': ('scale', 1.1)},
+    'Hybrid seed area -10%': {'Hybrid_Seeds_Area_Harvested_(Ha)': ('scale', 0.9)},
+    'Certified seed area +10%': {'Certified_Seeds_Area_Harvested(Ha)': ('scale', 1.1)},
+    'Total area +10%': {'Certified_Seeds_Area_Harvested(Ha)': ('scale', 1.1),
+                        'Hybrid_Seeds_Area_Harvested_(Ha)': ('scale', 1.1)},
+    'Dry season': {'Season': ('set', 1.0)},
+    'Wet season': {'Season': ('set', 2.0)},
+}
+
+
+# Columns that are the sum of other columns in the data. Unless a scenario changes them
+# itself, they move with their parts; otherwise a scenario would break the identity and
+# the individually unidentified coefficients of the collinear columns would dominate.
+SUM_COLUMNS = {
+    'Total_Area_Harvested(Ha)': ['Certified_Seeds_Area_Harvested(Ha)', 'Hybrid_Seeds_Area_Harvested_(Ha)'],
+}
+
+
+def wet_season_share(share):
+    # Season value for a share of Wet seasons, with the codes of data_cleaning.SEASON_CODES
+    # (Dry = 1, Wet = 2), i.e. the expected season code
+    return ('set', 1.0 + share)
+
+
+def baseline_exog(exog_data, steps):
+    # The dashboard's assumption: exogenous variables keep their last observed values
+    return np.tile(exog_data[-1, :], (steps, 1))
+
+
+def scenario_exog(baseline, exog_columns, scenarios):
+    # (n_scenarios, steps, k) future exogenous values of {name: {column: (operation, value)}};
+    # columns that are not in the model are ignored
+    scale = np.ones((len(scenarios), len(exog_columns)))
+    shift = np.zeros_like(scale)
+    replace = np.full_like(scale, np.nan)
+    for i, changes in enumerate(scenarios.values()):
+        for column, (operation, value) in changes.items():
+            if column not in exog_columns:
+                continue
+            j = exog_columns.index(column)
+            if operation == 'scale':
+                scale[i, j] *= value
+            elif operation == 'shift':
+                shift[i, j] += value
+            elif operation == 'set':
+                replace[i, j] = value
+            else:
+                raise ValueError(f"Unknown scenario operation {operation!r}")
+    future = baseline[None, :, :] * scale[:, None, :] + shift[:, None, :]
+    future = np.where(np.isnan(replace)[:, None, :], future, replace[:, None, :])
+
+    for total, parts in SUM_COLUMNS.items():
+        if total not in exog_columns or not all(part in exog_columns for part in parts):
+            continue
+        j = exog_columns.index(total)
+        linked = np.array([total not in changes for changes in scenarios.values()], dtype=bool)
+        part_change = sum(future[:, :, exog_columns.index(part)] - baseline[:, exog_columns.index(part)]
+                          for part in parts)
+        future[linked, :, j] = baseline[:, j] + part_change[linked]
+    return future
+
+
+def regression_coefficients(fit_model):
+    # Coefficients of the exogenous variables (they follow the trend terms in statsmodels' ordering)
+    model = fit_model.model
+    return np.asarray(fit_model.params)[model.k_trend:model.k_trend + model.k_exog]
+
+
+def scenario_forecasts(fit_model, exog_data, exog_columns, scenarios, steps, alpha=0.05):
+    # Forecasts of the baseline and every scenario. Returns (names, means, intervals) with
+    # means (n, steps) and intervals (n, steps, 2); the baseline comes first.
+    baseline = baseline_exog(exog_data, steps)
+    prediction = fit_model.get_forecast(steps=steps, exog=baseline)
+    base_mean = np.asarray(prediction.predicted_mean)
+    half_width = NormalDist().inv_cdf(1 - alpha / 2) * np.sqrt(np.asarray(prediction.var_pred_mean))
+
+    futures = np.concatenate((baseline[None], scenario_exog(baseline, exog_columns, scenarios)))
+    means = base_mean + (futures - baseline) @ regression_coefficients(fit_model)
+    intervals = np.stack((means - half_width, means + half_width), axis=-1)
+    return ['Baseline'] + list(scenarios), means, intervals
@@ -0,0 +1,260 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from correlation_engine import FOCUS_VARS
+from data_loading import CATEGORICAL_COLUMNS, DATE_COLUMNS, NUMERIC_COLUMNS, parse_dates
+from hierarchy import ADDITIVE_COLUMNS
+from sarimax_core import EXOGENOUS_VARS
+
+# Chunked ingest of large CSVs. The file is read CHUNK_ROWS rows at a time; every chunk
+# is validated, type-coerced, filtered and reduced to the columns the forecasting and
+# correlation steps use, then appended to a temporary Parquet file as one row group.
+# Only the (municipality, year) row counts stay in memory, so peak memory is bounded by
+# the chunk size instead of the file size; loads read the selected rows back from Parquet.
+#
+#   python streaming_ingest.py big.csv --start-year 2010 --municipalities SanMateo Alicia
+
+CHUNK_ROWS = 100_000
+
+# Uploads larger than this are streamed instead of parsed into memory at once
+STREAMING_THRESHOLD_BYTES = 50 * 2 ** 20
+
+REQUIRED_COLUMNS = ['Municipality', 'Total_Production(MT)']
+
+# Columns kept from the CSV: the dates (for Year and the correlation analysis), the
+# categorical columns, the hierarchy levels and the numeric columns used by the model,
+# the correlations or the hierarchy. Rows with a missing value in any other column are
+# dropped while reading, as objective1's cleaning would drop them after a full load.
+RETAINED_NUMERIC_COLUMNS = [column for column in NUMERIC_COLUMNS
+                            if column in EXOGENOUS_VARS + FOCUS_VARS + ADDITIVE_COLUMNS]
+LEVEL_COLUMNS = ['Province', 'Region']
+STRING_COLUMNS = CATEGORICAL_COLUMNS + LEVEL_COLUMNS
+RETAINED_COLUMNS = DATE_COLUMNS + STRING_COLUMNS + RETAINED_NUMERIC_COLUMNS
+
+# Dates and labels are read as strings; other columns are parsed as numbers by read_csv
+# and only coerced in the chunks where a value is not a number
+READ_DTYPES = {column: str for column in DATE_COLUMNS + STRING_COLUMNS}
+
+
+class _ProgressReader:
+    # File-like wrapper that counts the bytes read so far
+
+    def __init__(self, source):
+        self.source = source
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.source)
+
+
+def _total_bytes(source):
+    try:
+        position = source.tell()
+        total = source.seek(0, os.SEEK_END)
+        source.seek(position)
+        return total - position
+    except (AttributeError, OSError):
+        return None
+
+
+def _numeric(values):
+    # Float values; entries that are not numbers (which make read_csv fall back to
+    # strings for the whole column) become NaN
+    if pd.api.types.is_float_dtype(values):
+        return values
+    return pd.to_numeric(values, errors='coerce').astype('float64')
+
+
+def _complete(chunk, columns):
+    # Rows without missing or infinite values in `columns`
+    complete = pd.Series(True, index=chunk.index)
+    for column in columns:
+        if column in NUMERIC_COLUMNS:
+            values = _numeric(chunk[column])
+            complete &= values.notna() & ~np.isinf(values)
+        else:
+            complete &= chunk[column].notna()
+    return complete
+
+
+def _coerce(chunk, columns):
+    # Typed chunk with Year: dates parsed, numeric values coerced (invalid values become
+    # NaN), string values stripped
+    chunk = chunk[columns].copy()
+    for column in columns:
+        if column in DATE_COLUMNS:
+            chunk[column] = parse_dates(chunk[column])
+        elif column in STRING_COLUMNS:
+            chunk[column] = chunk[column].str.strip()
+        else:
+            chunk[column] = _numeric(chunk[column])
+    date_column = next(column for column in DATE_COLUMNS if column in columns)
+    chunk['Year'] = chunk[date_column].dt.year.astype('Int32')
+    return chunk
+
+
+class StreamingCSVSource:
+    # Dataset read from a CSV in chunks, with the same interface as
+    # data_loading.DataFrameSource and dataset_store.DatasetStore. Optional year and
+    # municipality filters are applied while reading; rows without a parsable date or a
+    # municipality, or incomplete in a column that is not kept, are counted as rejected.
+    # `progress(bytes_read, total_bytes, rows)` is called after every chunk (total_bytes
+    # is None for unseekable sources).
+
+    def __init__(self, source, municipalities=None, start_year=None, end_year=None, chunk_rows=CHUNK_ROWS,
+                 progress=None):
+        self.rows = 0
+        self.rejected = 0
+        self.filtered = 0
+        self._dir = tempfile.mkdtemp(prefix="streaming_ingest_")
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, ignore_errors=True)
+        self.path = os.path.join(self._dir, "data.parquet")
+
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                counts = self._ingest(f, municipalities, start_year, end_year, chunk_rows, progress)
+        else:
+            counts = self._ingest(source, municipalities, start_year, end_year, chunk_rows, progress)
+        if not counts:
+            raise ValueError("No rows with a valid date and municipality found in the dataset.")
+        self.partitions = pd.DataFrame(
+            [(municipality, int(year), int(rows)) for (municipality, year), rows in counts.items()],
+            columns=["municipality", "year", "rows"]
+        ).sort_values(["municipality", "year"], ignore_index=True)
+
+    def _ingest(self, source, municipalities, start_year, end_year, chunk_rows, progress):
+        total_bytes = _total_bytes(source)
+        reader = _ProgressReader(source)
+        chunks = pd.read_csv(reader, dtype=READ_DTYPES, chunksize=chunk_rows, encoding='utf-8-sig')
+        writer = None
+        counts = Counter()
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    columns = self._validate(chunk.columns)
+                    dropped = [column for column in chunk.columns if column not in columns]
+                    self.columns = columns + ['Year']
+                    schema = pa.schema(
+                        [(column, pa.timestamp('ns') if column in DATE_COLUMNS
+                          else pa.string() if column in STRING_COLUMNS else pa.float64())
+                         for column in columns] + [('Year', pa.int32())]
+                    )
+                    writer = pq.ParquetWriter(self.path, schema)
+
+                complete = _complete(chunk, dropped)
+                chunk = _coerce(chunk, columns)
+                valid = chunk['Year'].notna() & chunk['Municipality'].notna() & complete
+                self.rejected += int((~valid).sum())
+                keep = valid.copy()
+                if municipalities is not None:
+                    keep &= chunk['Municipality'].isin(municipalities)
+                if start_year is not None:
+                    keep &= chunk['Year'] >= start_year
+                if end_year is not None:
+                    keep &= chunk['Year'] <= end_year
+                self.filtered += int((valid & ~keep).sum())
+                chunk = chunk[keep.fillna(False).astype(bool)]
+
+                self.rows += len(chunk)
+                counts.update(chunk.groupby(['Municipality', 'Year']).size().to_dict())
+                writer.write_table(pa.Table.from_pandas(chunk.astype({'Year': 'int32'}), schema=schema,
+                                                        preserve_index=False))
+                if progress is not None:
+                    progress(reader.bytes_read, total_bytes, self.rows)
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            raise ValueError("The CSV file has no rows.")
+        return counts
+
+    @staticmethod
+    def _validate(header):
+        # Retained columns present in the header, in CSV order
+        missing = [column for column in REQUIRED_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+        if not any(column in header for column in DATE_COLUMNS):
+            raise ValueError("No valid date columns found in the dataset.")
+        return [column for column in header if column in RETAINED_COLUMNS]
+
+    def close(self):
+        # Remove the temporary Parquet file (also done when the source is garbage collected)
+        self._finalizer()
+
+    def overview(self):
+        return self.partitions
+
+    def year_range(self):
+        return int(self.partitions["year"].min()), int(self.partitions["year"].max())
+
+    def municipalities(self, start_year=None, end_year=None):
+        selected = self.partitions
+        if start_year is not None:
+            selected = selected[selected["year"] >= start_year]
+        if end_year is not None:
+            selected = selected[selected["year"] <= end_year]
+        return selected["municipality"].unique().tolist()
+
+    def load(self, municipalities=None, start_year=None, end_year=None):
+        # Typed frame (categoricals as in data_loading.read_dataset) of the selected rows
+        filters = []
+        if municipalities is not None:
+            filters.append(('Municipality', 'in', [str(municipality) for municipality in municipalities]))
+        if start_year is not None:
+            filters.append(('Year', '>=', int(start_year)))
+        if end_year is not None:
+            filters.append(('Year', '<=', int(end_year)))
+        df = pq.read_table(self.path, filters=filters or None).to_pandas()
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+        return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a large dataset CSV in chunks and summarize it.")
+    parser.add_argument("csv", help="Input CSV file in the dashboard's dataset format.")
+    parser.add_argument("--start-year", type=int, help="Drop rows before this year while reading.")
+    parser.add_argument("--end-year", type=int, help="Drop rows after this year while reading.")
+    parser.add_argument("--municipalities", nargs="+", help="Only keep these municipalities.")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help=f"Rows per chunk (default: {CHUNK_ROWS}).")
+    parser.add_argument("--output", help="Also write the retained rows to this Parquet file.")
+    args = parser.parse_args(argv)
+
+    def report(bytes_read, total_bytes, rows):
+        done = f"{bytes_read / total_bytes:6.1%}" if total_bytes else f"{bytes_read / 2 ** 20:.1f} MB"
+        print(f"\r{done} read, {rows} rows kept", end="", file=sys.stderr)
+
+    try:
+        source = StreamingCSVSource(args.csv, args.municipalities, args.start_year, args.end_year,
+                                    args.chunk_rows, progress=report)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(file=sys.stderr)
+    if args.output:
+        shutil.copyfile(source.path, args.output)
+    print(source.overview().groupby("municipality").agg(years=("year", "nunique"), first=("year", "min"),
+                                                         last=("year", "max"), rows=("rows", "sum")))
+    print(f"{source.rows} rows kept, {source.filtered} filtered out, {source.rejected} rejected")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())